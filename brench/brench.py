@@ -8,21 +8,52 @@ import re
 import csv
 import sys
 import os
+import io
+import json
+import time
+import threading
+import importlib
+import traceback
+import signal
+import statistics
+import multiprocessing
+from collections import namedtuple
 from concurrent import futures
 import glob
 
+try:
+    import resource
+except ImportError:  # Timing stages is only supported on POSIX systems.
+    resource = None
+
 __version__ = '1.0.0'
 
 ARGS_RE = r'ARGS: (.*)'
 
 
-def run_pipe(cmds, input, timeout):
+# The resources used by one pipeline stage: seconds of wall-clock, user,
+# and system time, and peak resident set size in kilobytes.
+Timing = namedtuple('Timing', ['wall', 'user', 'sys', 'maxrss'])
+
+
+def _maxrss(ru):
+    # macOS reports bytes; Linux reports kilobytes.
+    if sys.platform == 'darwin':
+        return ru.ru_maxrss // 1024
+    return ru.ru_maxrss
+
+
+def run_pipe(cmds, input, timeout, timings=None):
     """Execute a pipeline of shell commands.
 
     Send the given input (text) string into the first command, then pipe
     the output of each command into the next command in the sequence.
     Collect and return the stdout and stderr from the final command.
+
+    If `timings` is a list, append a `Timing` for each command. Its wall
+    time runs from the start of the pipeline until the command exits.
     """
+    start = time.perf_counter()
     procs = []
     for cmd in cmds:
         last = len(procs) == len(cmds) - 1
@@ -33,17 +64,231 @@ def run_pipe(cmds, input, timeout):
             stdin=procs[-1].stdout if procs else subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE if last else subprocess.DEVNULL,
+            # With timings, each command gets its own process group, so
+            # that a timeout can kill everything the shell started.
+            start_new_session=timings is not None,
         )
         procs.append(proc)
 
-    try:
-        # Send stdin and collect stdout.
-        procs[0].stdin.write(input)
-        procs[0].stdin.close()
-        return procs[-1].communicate(timeout=timeout)
-    finally:
+    if timings is None:
+        try:
+            # Send stdin and collect stdout.
+            procs[0].stdin.write(input)
+            procs[0].stdin.close()
+            return procs[-1].communicate(timeout=timeout)
+        finally:
+            for proc in procs:
+                proc.kill()
+
+    def feed(stream):
+        try:
+            stream.write(input)
+            stream.close()
+        except BrokenPipeError:
+            pass  # The command exited without reading all its input.
+
+    out, err = [], []
+
+    def drain(stream, chunks):
+        chunks.append(stream.read())
+
+    # Reap the processes ourselves (instead of via `communicate`) to get
+    # their resource usage.
+    usage = [None] * len(procs)
+
+    def reap(i):
+        _, status, ru = os.wait4(procs[i].pid, 0)
+        procs[i].returncode = (-os.WTERMSIG(status)
+                               if os.WIFSIGNALED(status)
+                               else os.WEXITSTATUS(status))
+        usage[i] = (time.perf_counter() - start, ru)
+
+    reapers = [threading.Thread(target=reap, args=(i,))
+               for i in range(len(procs))]
+    threads = reapers + [
+        threading.Thread(target=feed, args=(procs[0].stdin,)),
+        threading.Thread(target=drain, args=(procs[-1].stdout, out)),
+        threading.Thread(target=drain, args=(procs[-1].stderr, err)),
+    ]
+    for thread in threads:
+        thread.start()
+
+    deadline = start + timeout
+    for thread in reapers:
+        thread.join(max(0, deadline - time.perf_counter()))
+    timed_out = any(thread.is_alive() for thread in reapers)
+    if timed_out:
+        # Kill the whole process group of every command, since a
+        # process that the shell started could keep a pipe open.
         for proc in procs:
-            proc.kill()
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+    for thread in threads:
+        thread.join()
+    for proc in procs:
+        proc.stdout.close()
+        if proc.stderr:
+            proc.stderr.close()
+
+    if timed_out:
+        raise subprocess.TimeoutExpired(cmds, timeout)
+    if timings is not None:
+        for wall, ru in usage:
+            timings.append(Timing(wall, ru.ru_utime, ru.ru_stime,
+                                  _maxrss(ru)))
+    return ''.join(out), ''.join(err)
+
+
+class _ThreadOutput(io.TextIOBase):
+    """A stand-in for `sys.stdout` or `sys.stderr` that lets each thread
+    capture what it writes into its own buffer.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buf', None)
+        return (buf or self.stream).write(text)
+
+    def flush(self):
+        buf = getattr(self.local, 'buf', None)
+        (buf or self.stream).flush()
+
+
+_install_lock = threading.Lock()
+
+
+def _captured_streams():
+    """Make sure `sys.stdout` and `sys.stderr` support per-thread capture
+    and return them.
+    """
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = _ThreadOutput(sys.stdout)
+        if not isinstance(sys.stderr, _ThreadOutput):
+            sys.stderr = _ThreadOutput(sys.stderr)
+    return sys.stdout, sys.stderr
+
+
+_callables = {}
+_import_lock = threading.Lock()
+
+
+def load_callable(spec, search_path):
+    """Get the Python function named by `spec`, like `examples.lvn:lvn`.
+
+    The module path is first looked for as a file under each directory in
+    `search_path` (so `examples.lvn` can be `examples/lvn.py`). That
+    file's directory goes on the import path, so the module can import
+    its neighbors the same way it does when run as a script. Otherwise,
+    the module is imported normally.
+    """
+    with _import_lock:
+        if spec not in _callables:
+            mod_name, _, func_name = spec.partition(':')
+            parts = mod_name.split('.')
+            for base in search_path:
+                dirname = os.path.abspath(os.path.join(base, *parts[:-1]))
+                if os.path.isfile(os.path.join(dirname, parts[-1] + '.py')):
+                    if dirname not in sys.path:
+                        sys.path.insert(0, dirname)
+                    mod = importlib.import_module(parts[-1])
+                    break
+            else:
+                mod = importlib.import_module(mod_name)
+            _callables[spec] = getattr(mod, func_name)
+        return _callables[spec]
+
+
+def run_calls(stages, prog, timings=None):
+    """Execute a sequence of in-process stages on a parsed program.
+
+    Each stage is a `(func, args, per_function)` triple. The function
+    gets the program (or, if `per_function` is set, each function in the
+    program) followed by `args`. It may modify its argument in place or
+    return a replacement. Return the resulting program along with the
+    text the last stage printed to stdout and stderr.
+
+    If `timings` is a list, append a `Timing` for each stage. The CPU
+    times and peak memory are those of the whole Brench process, so
+    they are only precise when nothing else runs alongside the stage.
+    """
+    stdout, stderr = _captured_streams()
+    out = err = ''
+    for func, args, per_function in stages:
+        stdout.local.buf = io.StringIO()
+        stderr.local.buf = io.StringIO()
+        start = time.perf_counter()
+        if timings is not None:
+            ru_start = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            if per_function:
+                funcs = prog['functions']
+                for i, f in enumerate(funcs):
+                    res = func(f, *args)
+                    if isinstance(res, dict):
+                        funcs[i] = res
+            else:
+                res = func(prog, *args)
+                if isinstance(res, dict):
+                    prog = res
+        finally:
+            out = stdout.local.buf.getvalue()
+            err = stderr.local.buf.getvalue()
+            stdout.local.buf = stderr.local.buf = None
+        if timings is not None:
+            ru = resource.getrusage(resource.RUSAGE_SELF)
+            timings.append(Timing(
+                time.perf_counter() - start,
+                ru.ru_utime - ru_start.ru_utime,
+                ru.ru_stime - ru_start.ru_stime,
+                _maxrss(ru),
+            ))
+    return prog, out, err
+
+
+def run_stages(stages, input, timeout, timings=None):
+    """Execute a pipeline that mixes shell commands (strings) and
+    in-process stages (see `run_calls`).
+
+    Consecutive shell commands run as a pipe; consecutive in-process
+    stages pass the parsed program along without serializing it. Return
+    the stdout and stderr from the final stage, like `run_pipe`, and
+    collect `timings` for each stage in the same way.
+    """
+    start = time.time()
+    data, out, err = input, input, ''
+    i = 0
+    while i < len(stages):
+        j = i + 1
+        shell = isinstance(stages[i], str)
+        while j < len(stages) and isinstance(stages[j], str) == shell:
+            j += 1
+
+        remaining = timeout - (time.time() - start)
+        if remaining <= 0:
+            raise subprocess.TimeoutExpired(stages[i], timeout)
+
+        if shell:
+            text = data if isinstance(data, str) else json.dumps(data)
+            out, err = run_pipe(stages[i:j], text, remaining, timings)
+            data = out
+        else:
+            try:
+                prog = json.loads(data) if isinstance(data, str) else data
+                data, out, err = run_calls(stages[i:j], prog, timings)
+            except Exception:
+                # Treat this like a crashing process.
+                return '', traceback.format_exc()
+        i = j
+
+    if time.time() - start > timeout:
+        raise subprocess.TimeoutExpired(stages[-1], timeout)
+    return out, err
 
 
 def compare_output(o1, o2, ε=0.0):
@@ -55,8 +300,13 @@ def compare_output(o1, o2, ε=0.0):
     return all(my_compare(x, y) for x, y in zip(o1.split(), o2.split()))
 
 
-def run_bench(pipeline, fn, timeout):
+def run_bench(pipeline, fn, timeout, search_path=('.',), timed=False):
     """Run a single benchmark pipeline.
+
+    Pipeline stages are shell commands or, for in-process stages, tables
+    with a `call` key naming a Python function (see `load_callable`).
+    Return the stdout and stderr of the last stage and, if `timed` is
+    set, a list of `Timing`s, one per stage (otherwise None).
     """
     # Load the benchmark.
     with open(fn) as f:
@@ -67,11 +317,77 @@ def run_bench(pipeline, fn, timeout):
     args = match.group(1) if match else ''
 
     # Run pipeline.
-    cmds = [
-        c.format(args=args)
-        for c in pipeline
-    ]
-    return run_pipe(cmds, in_data, timeout)
+    stages = []
+    for stage in pipeline:
+        if isinstance(stage, str):
+            stages.append(stage.format(args=args))
+        else:
+            stages.append((
+                load_callable(stage['call'], search_path),
+                [a.format(args=args) if isinstance(a, str) else a
+                 for a in stage.get('args', [])],
+                stage.get('per_function', False),
+            ))
+    timings = [] if timed else None
+    if all(isinstance(s, str) for s in stages):
+        stdout, stderr = run_pipe(stages, in_data, timeout, timings)
+    else:
+        stdout, stderr = run_stages(stages, in_data, timeout, timings)
+    return stdout, stderr, timings
+
+
+def _plain(value):
+    """Convert TOML data to plain Python values, which can be sent to
+    worker processes.
+    """
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_plain(v) for v in value]
+    elif isinstance(value, str):
+        return str(value)
+    return getattr(value, 'unwrap', lambda: value)()
+
+
+def _pin_worker(cpus, counter):
+    """Pin a worker process to one of `cpus`, taking turns.
+    """
+    with counter.get_lock():
+        n = counter.value
+        counter.value += 1
+    os.sched_setaffinity(0, {cpus[n % len(cpus)]})
+
+
+def timing_columns(n_stages, repeat):
+    """Get the CSV column names for the timings of each stage.
+    """
+    cols = []
+    for i in range(n_stages):
+        for field in Timing._fields:
+            if repeat == 1:
+                cols.append('{}{}'.format(field, i))
+            else:
+                cols += ['{}{}_min'.format(field, i),
+                         '{}{}_median'.format(field, i)]
+    return cols
+
+
+def timing_values(n_stages, repeat, rep_timings):
+    """Summarize the timings from every repetition of one benchmark run
+    as CSV values for `timing_columns`.
+    """
+    vals = []
+    for i in range(n_stages):
+        for field in range(len(Timing._fields)):
+            samples = [t[i][field] for t in rep_timings if len(t) > i]
+            if not samples:
+                vals += [''] * (1 if repeat == 1 else 2)
+            elif repeat == 1:
+                vals.append(samples[0])
+            else:
+                vals += [min(samples), statistics.median(samples)]
+    return ['{:.6f}'.format(v) if isinstance(v, float) else v
+            for v in vals]
 
 
 def get_result(strings, extract_re):
@@ -87,9 +403,17 @@ def get_result(strings, extract_re):
 @click.command()
 @click.option('-j', '--jobs', default=None, type=int,
               help='parallel threads to use (default: suitable for machine)')
+@click.option('--processes', is_flag=True,
+              help='run jobs in worker processes instead of threads')
+@click.option('--pin', is_flag=True,
+              help='pin each worker process to its own CPU')
+@click.option('--repeat', default=1, type=click.IntRange(min=1),
+              help='run each benchmark this many times')
+@click.option('--time', 'show_time', is_flag=True,
+              help='report time and memory for each pipeline stage')
 @click.argument('config_path', metavar='CONFIG', type=click.Path(exists=True))
 @click.argument('files', nargs=-1, type=click.Path(exists=True))
-def brench(config_path, files, jobs):
+def brench(config_path, files, jobs, processes, pin, repeat, show_time):
     """Run a batch of benchmarks and emit a CSV of results.
     """
     with open(config_path) as f:
@@ -102,27 +426,64 @@ def brench(config_path, files, jobs):
     timeout = config.get('timeout', 5)
     ε = config.get('epsilon', 0.0)
 
-    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
-        # Submit jobs.
+    # Where to look for the modules of in-process stages.
+    config_dir = os.path.dirname(os.path.abspath(config_path))
+    search_path = ['.'] + [os.path.join(config_dir, d)
+                           for d in config.get('pythonpath', ['.'])]
+
+    runs = _plain(config['runs'])
+    n_stages = max(len(run['pipeline']) for run in runs.values())
+
+    if show_time and resource is None:
+        raise click.UsageError('--time is not supported here')
+    if pin and not processes:
+        raise click.UsageError('--pin requires --processes')
+    if processes:
+        initializer, initargs = None, ()
+        if pin:
+            if not hasattr(os, 'sched_setaffinity'):
+                raise click.UsageError('CPU pinning is not supported here')
+            initializer = _pin_worker
+            initargs = (sorted(os.sched_getaffinity(0)),
+                        multiprocessing.Value('i', 0))
+        pool = futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=initializer, initargs=initargs,
+        )
+    else:
+        pool = futures.ThreadPoolExecutor(max_workers=jobs)
+
+    with pool:
+        # Submit jobs. Interleave the repetitions so that they don't all
+        # run under the same conditions.
         futs = {}
-        for fn in files:
-            for name, run in config['runs'].items():
-                futs[(fn, name)] = pool.submit(run_bench, run['pipeline'], fn,
-                                               timeout)
+        for i in range(repeat):
+            for fn in files:
+                for name, run in runs.items():
+                    futs[(fn, name, i)] = pool.submit(
+                        run_bench, run['pipeline'], fn, timeout, search_path,
+                        show_time,
+                    )
 
         # Collect results and print CSV.
         writer = csv.writer(sys.stdout)
-        writer.writerow(['benchmark', 'run', 'result'])
+        header = ['benchmark', 'run', 'result']
+        if show_time:
+            header += timing_columns(n_stages, repeat)
+        writer.writerow(header)
         for fn in files:
             first_out = None
-            for name in config['runs']:
+            for name in runs:
+                rep_timings = []
+                status = None
                 try:
-                    stdout, stderr = futs[(fn, name)].result()
+                    for i in range(repeat):
+                        out = futs[(fn, name, i)].result()
+                        rep_timings.append(out[2])
+                        if i == 0:
+                            stdout, stderr, _ = out
                 except subprocess.TimeoutExpired:
                     stdout, stderr = '', ''
                     status = 'timeout'
-                else:
-                    status = None
 
                 # Check correctness.
                 if first_out is None:
@@ -137,11 +498,16 @@ def brench(config_path, files, jobs):
 
                 # Report the result.
                 bench, _ = os.path.splitext(os.path.basename(fn))
-                writer.writerow([
+                row = [
                     bench,
                     name,
                     status if status else result,
-                ])
+                ]
+                if show_time:
+                    if status == 'timeout':
+                        rep_timings = []
+                    row += timing_values(n_stages, repeat, rep_timings)
+                writer.writerow(row)
 
 
 if __name__ == '__main__':
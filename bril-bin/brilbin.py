@@ -0,0 +1,581 @@
+"""A compact binary encoding for Bril programs.
+
+The format is meant for passing programs between tools in a pipeline,
+where decoding and re-encoding JSON would otherwise take a large share
+of the time. There are two commands: `bril2bin`, which converts a JSON
+program to the binary format, and `bin2json`, which converts it back.
+
+A file starts with `MAGIC` and three little-endian 64-bit offsets: of the
+string table, the function index, and the other top-level data (such as
+`structs`). Everything else is a sequence of unsigned LEB128 varints.
+All strings (variable names, labels, and so on) are interned in the
+string table and referred to by number, and opcodes are small numbers.
+The function index records where each function's encoding starts and
+ends, so `load` can memory-map a file and decode each function only
+when it is first used. Functions that were never decoded are copied to
+the output as they are. `load_funcs` and `dump_funcs` go further and
+stream a program one function at a time.
+"""
+
+import json
+import mmap
+import re
+import struct
+import sys
+from collections.abc import MutableSequence
+
+__version__ = '0.0.1'
+
+MAGIC = b'\0BRILBIN'
+_HEADER = struct.Struct('<QQQ')
+
+# Opcodes get numbers by their position in this list. Append new ones
+# at the end to keep old files readable.
+OPCODES = [
+    'const', 'id', 'add', 'mul', 'sub', 'div', 'eq', 'lt', 'gt', 'le', 'ge',
+    'not', 'and', 'or', 'jmp', 'br', 'call', 'ret', 'print', 'nop',
+    'alloc', 'free', 'store', 'load', 'ptradd',
+    'fadd', 'fmul', 'fsub', 'fdiv', 'feq', 'flt', 'fgt', 'fle', 'fge',
+    'phi', 'speculate', 'commit', 'guard',
+]
+_OPCODE_NUMS = {op: i for i, op in enumerate(OPCODES)}
+
+# Instruction kinds that come before the opcodes.
+_LABEL = 0
+_OTHER_OP = 1  # An opcode that is not in `OPCODES`.
+_FIRST_OP = 2
+
+# Flags for the fields present in an instruction.
+_DEST = 1
+_TYPE = 2
+_ARGS = 4
+_FUNCS = 8
+_LABELS = 16
+_VALUE = 32
+_EXTRA = 64
+_FIELDS = {'op', 'label', 'dest', 'type', 'args', 'funcs', 'labels', 'value'}
+
+# Tags for general JSON values.
+_NULL, _FALSE, _TRUE, _INT, _NEG_INT, _FLOAT, _STR, _LIST, _DICT = range(9)
+
+_VARINT = re.compile(rb'[\x80-\xff]*[\x00-\x7f]')
+_DOUBLE = struct.Struct('<d')
+_UINT64 = struct.Struct('<Q')
+
+
+# Encoding.
+
+def _varint_bytes(nums):
+    """Encode a list of nonnegative integers as varints.
+    """
+    if not nums or max(nums) < 0x80:
+        return bytes(nums)
+    out = bytearray()
+    for n in nums:
+        while n >= 0x80:
+            out.append(n & 0x7f | 0x80)
+            n >>= 7
+        out.append(n)
+    return bytes(out)
+
+
+class _Encoder:
+    """Encode functions into a list of numbers, interning strings as it
+    goes.
+    """
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.string_nums = {s: i for i, s in enumerate(self.strings)}
+
+    def string(self, s):
+        try:
+            return self.string_nums[s]
+        except KeyError:
+            n = self.string_nums[s] = len(self.strings)
+            self.strings.append(s)
+            return n
+
+    def value(self, out, val):
+        if val is None:
+            out.append(_NULL)
+        elif val is True:
+            out.append(_TRUE)
+        elif val is False:
+            out.append(_FALSE)
+        elif isinstance(val, int):
+            if val >= 0:
+                out += (_INT, val)
+            else:
+                out += (_NEG_INT, -val - 1)
+        elif isinstance(val, float):
+            out += (_FLOAT, _UINT64.unpack(_DOUBLE.pack(val))[0])
+        elif isinstance(val, str):
+            out += (_STR, self.string(val))
+        elif isinstance(val, (list, tuple)):
+            out += (_LIST, len(val))
+            for v in val:
+                self.value(out, v)
+        elif isinstance(val, dict):
+            out += (_DICT, len(val))
+            for k, v in val.items():
+                out.append(self.string(k))
+                self.value(out, v)
+        else:
+            raise TypeError('cannot encode {!r}'.format(val))
+
+    def names(self, out, names):
+        out.append(len(names))
+        out.extend(self.string(n) for n in names)
+
+    def instr(self, out, instr):
+        extra = [k for k in instr if k not in _FIELDS]
+        if 'label' in instr:
+            out += (_LABEL, _EXTRA if extra else 0,
+                    self.string(instr['label']))
+        else:
+            op = instr['op']
+            flags = (
+                ('dest' in instr and _DEST) |
+                ('type' in instr and _TYPE) |
+                ('args' in instr and _ARGS) |
+                ('funcs' in instr and _FUNCS) |
+                ('labels' in instr and _LABELS) |
+                ('value' in instr and _VALUE) |
+                (_EXTRA if extra else 0)
+            )
+            if op in _OPCODE_NUMS:
+                out += (_OPCODE_NUMS[op] + _FIRST_OP, flags)
+            else:
+                out += (_OTHER_OP, flags, self.string(op))
+            if flags & _DEST:
+                out.append(self.string(instr['dest']))
+            if flags & _TYPE:
+                self.value(out, instr['type'])
+            if flags & _ARGS:
+                self.names(out, instr['args'])
+            if flags & _FUNCS:
+                self.names(out, instr['funcs'])
+            if flags & _LABELS:
+                self.names(out, instr['labels'])
+            if flags & _VALUE:
+                self.value(out, instr['value'])
+        if extra:
+            self.value(out, {k: instr[k] for k in extra})
+
+    def func(self, func):
+        out = [self.string(func['name'])]
+        self.value(out, {k: v for k, v in func.items()
+                         if k not in ('name', 'instrs')})
+        out.append(len(func['instrs']))
+        for instr in func['instrs']:
+            self.instr(out, instr)
+        return _varint_bytes(out)
+
+
+def _pack(enc, bodies, other):
+    """Assemble a binary program from the encodings of its functions and
+    its other top-level data.
+
+    `other` is encoded only after all of `bodies` has been consumed.
+    """
+    body = []
+    index = []
+    offset = len(MAGIC) + _HEADER.size
+    for data in bodies:
+        body.append(data)
+        index += (offset, len(data))
+        offset += len(data)
+
+    out = []
+    enc.value(out, other)
+    extras = _varint_bytes(out)
+
+    strings = bytearray(_varint_bytes([len(enc.strings)]))
+    for s in enc.strings:
+        b = s.encode('utf8')
+        strings += _varint_bytes([len(b)])
+        strings += b
+    index = _varint_bytes([len(body)] + index)
+
+    header = _HEADER.pack(offset, offset + len(strings),
+                          offset + len(strings) + len(index))
+    return b''.join([MAGIC, header] + body + [bytes(strings), index, extras])
+
+
+def dumps(prog):
+    """Encode a Bril program in the binary format.
+    """
+    funcs = prog['functions']
+
+    # Functions loaded from another binary program that were never
+    # decoded can be copied verbatim, as long as we keep that program's
+    # string numbering.
+    lazy = funcs if isinstance(funcs, LazyFunctions) else None
+    enc = _Encoder(lazy.strings if lazy is not None else ())
+
+    def bodies():
+        for i in range(len(funcs)):
+            data = lazy.raw(i) if lazy is not None else None
+            yield data if data is not None else enc.func(funcs[i])
+
+    return _pack(enc, bodies(),
+                 {k: v for k, v in prog.items() if k != 'functions'})
+
+
+def dump(prog, f):
+    """Write a Bril program in the binary format to a binary stream.
+    """
+    f.write(dumps(prog))
+
+
+def dump_funcs(funcs, other, f):
+    """Write a program in the binary format to a binary stream, given an
+    iterable of its functions and a dict of its other top-level data.
+
+    Each function is encoded as soon as it is produced, so only the
+    (compact) encoding of the whole program is kept in memory. `other`
+    is read after the last function.
+    """
+    enc = _Encoder()
+    f.write(_pack(enc, (enc.func(func) for func in funcs), other))
+
+
+# Decoding.
+
+def _varint(tok):
+    n = 0
+    for i, b in enumerate(tok):
+        n |= (b & 0x7f) << (7 * i)
+    return n
+
+
+def _varints(data, start, end):
+    """Decode all the varints in a range of a buffer.
+    """
+    return [t[0] if len(t) == 1 else _varint(t)
+            for t in _VARINT.findall(data, start, end)]
+
+
+class _Decoder:
+    """Decode values from a list of numbers.
+    """
+
+    def __init__(self, nums, strings):
+        self.nums = nums
+        self.strings = strings
+        self.pos = 0
+
+    def next(self):
+        n = self.nums[self.pos]
+        self.pos += 1
+        return n
+
+    def string(self):
+        return self.strings[self.next()]
+
+    def names(self):
+        n = self.next()
+        start = self.pos
+        self.pos += n
+        strings = self.strings
+        return [strings[i] for i in self.nums[start:self.pos]]
+
+    def value(self):
+        tag = self.next()
+        if tag == _STR:
+            return self.string()
+        elif tag == _INT:
+            return self.next()
+        elif tag == _NULL:
+            return None
+        elif tag == _TRUE:
+            return True
+        elif tag == _FALSE:
+            return False
+        elif tag == _NEG_INT:
+            return -self.next() - 1
+        elif tag == _FLOAT:
+            return _DOUBLE.unpack(_UINT64.pack(self.next()))[0]
+        elif tag == _LIST:
+            return [self.value() for _ in range(self.next())]
+        elif tag == _DICT:
+            out = {}
+            for _ in range(self.next()):
+                key = self.string()
+                out[key] = self.value()
+            return out
+        raise ValueError('bad value tag {}'.format(tag))
+
+    def instr(self):
+        kind = self.next()
+        flags = self.next()
+        if kind == _LABEL:
+            instr = {'label': self.string()}
+        else:
+            if kind == _OTHER_OP:
+                instr = {'op': self.string()}
+            else:
+                instr = {'op': OPCODES[kind - _FIRST_OP]}
+            if flags & _DEST:
+                instr['dest'] = self.string()
+            if flags & _TYPE:
+                instr['type'] = self.value()
+            if flags & _ARGS:
+                instr['args'] = self.names()
+            if flags & _FUNCS:
+                instr['funcs'] = self.names()
+            if flags & _LABELS:
+                instr['labels'] = self.names()
+            if flags & _VALUE:
+                instr['value'] = self.value()
+        if flags & _EXTRA:
+            instr.update(self.value())
+        return instr
+
+    def func(self):
+        func = {'name': self.string()}
+        func.update(self.value())
+        func['instrs'] = [self.instr() for _ in range(self.next())]
+        return func
+
+
+class LazyFunctions(MutableSequence):
+    """The functions of a binary program, each decoded the first time it
+    is used.
+    """
+
+    def __init__(self, data, strings, index):
+        self.data = data
+        self.strings = strings
+        self._funcs = [None] * len(index)
+        self._index = list(index)
+
+    def raw(self, i):
+        """Get the encoding of a function that has not been decoded yet,
+        or None if it has been.
+        """
+        if self._funcs[i] is None:
+            start, end = self._index[i]
+            return bytes(self.data[start:end])
+        return None
+
+    def _decode(self, i):
+        func = self._funcs[i]
+        if func is None:
+            start, end = self._index[i]
+            nums = _varints(self.data, start, end)
+            func = self._funcs[i] = _Decoder(nums, self.strings).func()
+        return func
+
+    def __len__(self):
+        return len(self._funcs)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._decode(j) for j in range(len(self))[i]]
+        return self._decode(range(len(self))[i])
+
+    def __setitem__(self, i, func):
+        if isinstance(i, slice):
+            self._funcs = self[:]
+            self._funcs[i] = func
+            self._index = [None] * len(self._funcs)
+        else:
+            self._funcs[i] = func
+
+    def __delitem__(self, i):
+        del self._funcs[i]
+        del self._index[i]
+
+    def insert(self, i, func):
+        self._funcs.insert(i, func)
+        self._index.insert(i, None)
+
+    def __deepcopy__(self, memo):
+        import copy
+        return copy.deepcopy(list(self), memo)
+
+
+def loads(data):
+    """Decode a Bril program from a binary buffer (such as `bytes` or an
+    `mmap`).
+
+    The program's `functions` are a `LazyFunctions` sequence, which keeps
+    a reference to `data`. Everything else is decoded right away.
+    """
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('not a binary Bril program')
+    strings_off, index_off, extras_off = _HEADER.unpack_from(data, len(MAGIC))
+
+    pos = strings_off
+    m = _VARINT.match(data, pos)
+    count = _varint(m.group())
+    pos = m.end()
+    strings = []
+    for _ in range(count):
+        m = _VARINT.match(data, pos)
+        end = m.end() + _varint(m.group())
+        strings.append(str(data[m.end():end], 'utf8'))
+        pos = end
+
+    nums = _varints(data, index_off, extras_off)
+    index = [(nums[i], nums[i] + nums[i + 1])
+             for i in range(1, len(nums), 2)]
+
+    prog = _Decoder(_varints(data, extras_off, len(data)), strings).value()
+    prog['functions'] = LazyFunctions(data, strings, index)
+    return prog
+
+
+def load(f):
+    """Read a binary Bril program from a binary stream.
+
+    If the stream is a file, it is memory-mapped instead of read.
+    """
+    try:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        data = f.read()
+    return loads(data)
+
+
+def load_funcs(f, other=None):
+    """Read a binary Bril program from a binary stream and get an
+    iterator over its functions.
+
+    Unlike with `load`, each function is decoded when the iterator
+    reaches it and is not kept afterward. The other top-level data (such
+    as `structs`) is added to the `other` dict, if given.
+    """
+    prog = load(f)
+    funcs = prog.pop('functions')
+    if other is not None:
+        other.update(prog)
+    return (_Decoder(_varints(funcs.data, start, end), funcs.strings).func()
+            for start, end in funcs._index)
+
+
+def is_binary(f):
+    """Check whether a buffered binary stream holds a binary program,
+    without consuming any of it.
+    """
+    # JSON text cannot start with the NUL byte that starts `MAGIC`.
+    return f.peek(1)[:1] == MAGIC[:1]
+
+
+def to_json(prog):
+    """Convert a program (possibly with lazy functions) to plain JSON
+    data.
+    """
+    out = dict(prog)
+    out['functions'] = list(prog['functions'])
+    return out
+
+
+# Streaming JSON input. This lives here, away from the text format's
+# parser, so that tools can stream JSON programs without depending on
+# lark.
+
+_WS = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStream:
+    """Decode JSON values from a text stream one at a time, reading only
+    as much of the stream as each value needs.
+    """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _read(self, amount):
+        data = self.stream.read(amount)
+        if not data:
+            self.eof = True
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    def peek(self):
+        """Skip whitespace and get the next character (or '' at the end).
+        """
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos:self.pos + 1]
+            self._read(self.chunk_size)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError('expected {!r} in JSON input'.format(char))
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value.
+        """
+        self.peek()
+        amount = self.chunk_size
+        while True:
+            try:
+                val, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # A number at the end of the buffer might continue.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return val
+            # Read more. Grow the amount so that large values don't get
+            # decoded over and over.
+            self._read(amount)
+            amount = max(amount, len(self.buf))
+
+
+def load_json_funcs(stream, other=None, chunk_size=1 << 16):
+    """Decode the functions in a JSON Bril program from a text stream,
+    yielding each one as soon as it has been read.
+
+    Other top-level keys (such as `structs`) are stored in the `other`
+    dict, if given, as they are encountered.
+    """
+    js = _JSONStream(stream, chunk_size)
+    js.expect('{')
+    if js.peek() == '}':
+        return
+    while True:
+        key = js.value()
+        js.expect(':')
+        if key == 'functions':
+            js.expect('[')
+            if js.peek() == ']':
+                js.pos += 1
+            else:
+                while True:
+                    yield js.value()
+                    if js.peek() == ']':
+                        js.pos += 1
+                        break
+                    js.expect(',')
+        else:
+            val = js.value()
+            if other is not None:
+                other[key] = val
+        if js.peek() == '}':
+            return
+        js.expect(',')
+
+
+# Command-line entry points.
+
+def bril2bin():
+    dump(json.load(sys.stdin), sys.stdout.buffer)
+
+
+def bin2json():
+    prog = load(sys.stdin.buffer)
+    print(json.dumps(to_json(prog), indent=2, sort_keys=True))
@@ -0,0 +1,129 @@
+"""A content-addressed cache for the results of processing Bril functions.
+
+Tools that optimize or compile a program one function at a time can
+store the result for each function under a hash of everything that
+determines it: the function itself, the passes and their options, and
+the version of the tool. A later run on an unchanged function reads the
+result back instead of redoing the work.
+
+The cache is a directory with one file per entry, named by its key. Each
+hit updates the entry's modification time, and `trim` deletes the least
+recently used entries until the cache fits in its size limit. Tools use
+the directory named by the `BRIL_CACHE` environment variable (see
+`from_env`), so there is no caching unless it is set.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import tempfile
+
+__version__ = '0.0.1'
+
+# The default size limit, in bytes.
+DEFAULT_SIZE = 256 << 20
+
+
+def key(*parts):
+    """Hash some JSON values into a key. Dicts are hashed with sorted
+    keys, so equal values always get the same key.
+    """
+    text = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def source_version(*paths):
+    """Hash the contents of some files, to serve as the version of a tool
+    whose source they are.
+    """
+    h = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+class Cache:
+    """Byte strings stored by key in a directory, holding at most about
+    `max_size` bytes after each `trim`.
+    """
+
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+    def _file(self, key):
+        # Spread the entries over subdirectories to keep them small.
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def get(self, key):
+        """Get the data stored under a key, or None if there is none.
+        """
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def put(self, key, data):
+        """Store data under a key. The entry appears all at once, so other
+        processes using the cache never see part of it.
+        """
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def trim(self):
+        """Delete the least recently used entries until the cache is no
+        bigger than `max_size`.
+        """
+        entries = []
+        total = 0
+        try:
+            subdirs = [d.path for d in os.scandir(self.path) if d.is_dir()]
+        except FileNotFoundError:
+            return
+        for subdir in subdirs:
+            for entry in os.scandir(subdir):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def from_env():
+    """Get the `Cache` in the directory named by the `BRIL_CACHE`
+    environment variable, with the size limit in `BRIL_CACHE_SIZE` (in
+    bytes), or None if `BRIL_CACHE` is not set. The cache is trimmed
+    when the program exits.
+    """
+    path = os.environ.get('BRIL_CACHE')
+    if not path:
+        return None
+    cache = Cache(path, int(os.environ.get('BRIL_CACHE_SIZE',
+                                           DEFAULT_SIZE)))
+    atexit.register(cache.trim)
+    return cache
@@ -2,11 +2,23 @@
 
 # Mark Moeller:
 
+import json
 import sys
 
 TERM = 'jmp', 'br', 'ret'
 
 
+def load_prog(f=None):
+    """Read a Bril program in JSON or in the binary format from
+    `bril-bin`.
+    """
+    import brilbin
+    f = getattr(f or sys.stdin, 'buffer', f or sys.stdin)
+    if brilbin.is_binary(f):
+        return brilbin.load(f)
+    return json.load(f)
+
+
 # From Lesson 2
 def form_blocks(body):
     cur_block = []
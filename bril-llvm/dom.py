@@ -1,92 +1,109 @@
 #!/usr/bin/python3
 
-import sys
-import json
 from brilpy import *
-from functools import reduce
+from functools import cached_property
 
 class Dominators:
 
-    def __init__(self, func):
-        g = CFG(func)
-
-        # First compute dominators
-        # IMPORTANT: This computes, for each block, the set of blocks that dominate
-        # it, not the other way around
-        self.doms = []
-        self.doms.append(set([0])) # Entry block is special, it's its own dominator
-        for i in range(1,g.n):
-            self.doms.append(set(range(g.n)))
-
-        order = g.rpo()
-
+    # Pass the function's `CFG` as `g` if it has already been built.
+    def __init__(self, func, g=None):
+        if g is None:
+            g = CFG(func)
+        self.n = g.n
+
+        # Compute immediate dominators with the iterative algorithm from
+        # Cooper, Harvey, and Kennedy, "A Simple, Fast Dominance Algorithm".
+        # Blocks reachable from the entry are numbered in reverse postorder,
+        # so a block's dominators always have smaller numbers than it does.
+        postorder = []
+        g.dfs(order=[0], post=postorder.append)
+        order = list(reversed(postorder))
+        rpo_num = {b: i for i, b in enumerate(order)}
+
+        def intersect(a, b):
+            while a != b:
+                while rpo_num[a] > rpo_num[b]:
+                    a = self.idom[a]
+                while rpo_num[b] > rpo_num[a]:
+                    b = self.idom[b]
+            return a
+
+        # idom[i] is the immediate dominator of block i, or None for the
+        # entry block and unreachable blocks
+        self.idom = [None] * g.n
+        self.idom[0] = 0
         changed = True
         while changed:
             changed = False
             for i in order[1:]: # no one can dominate 0 except 0
-                d = {i}
-                if g.preds[i]:
-                    d |= reduce(set.intersection, [self.doms[p] for p in g.preds[i]], set(range(g.n)))
-
-                if d != self.doms[i]:
+                new_idom = None
+                for p in g.preds[i]:
+                    if self.idom[p] is None: # unreachable or not yet visited
+                        continue
+                    new_idom = p if new_idom is None else intersect(p, new_idom)
+                if new_idom != self.idom[i]:
                     changed = True
-                    self.doms[i] = d
-
-        # Compute the "other way around" (from above), that is, for each block, the
-        # set of blocks this block dominates
-        self.dom_by = []
-        for i in range(g.n):
-            self.dom_by.append(set())
-
-        for i,d in enumerate(self.doms):
-            for mbr in d:
-                self.dom_by[mbr].add(i)
-
-
-
-        # Compute the dominance tree
-        dt_parent = [None]
+                    self.idom[i] = new_idom
+        self.idom[0] = None
 
+        # Compute the dominance tree: parent -> list of children. The entry
+        # block is the (only) child of None.
+        self.dom_tree = {None: [0]}
         for i in range(1, g.n):
-            for j in self.doms[i]:
-                if i != j:  # j strictly dominates i
-                    immed_dom = True
-                    for k in range(g.n):
-                        if k != j and k != i and j in self.doms[k] and k in self.doms[i]:
-                            immed_dom = False
-                            break
-                    if immed_dom:
-                        dt_parent.append(j)
-                        break
-
-        self.dom_tree = {}
-        for i,p in enumerate(dt_parent):
-            if p in self.dom_tree:
-                self.dom_tree[p].append(i)
-            else:
-                self.dom_tree[p] = [i]
-
-        # Compute dominance frontier
+            p = self.idom[i]
+            if p is not None:
+                self.dom_tree.setdefault(p, []).append(i)
+
+        # Compute dominance frontier with the "runner" algorithm: a join point
+        # is in the frontier of every block on the dominator tree path from
+        # each of its predecessors up to (not including) its idom.
         self.frontier = []
         for i in range(g.n):
             self.frontier.append(set())
 
-        for i,d in enumerate(self.doms):
-            # Union of dominators for this node's preds
-            pre_doms = reduce(set.union, [self.doms[p] for p in g.preds[i]], set())
-            # Subtract out strict dominators for this node
-            pre_doms = pre_doms.difference(self.doms[i].difference(set([i])))
+        for i in order:
+            reachable_preds = [p for p in g.preds[i] if p in rpo_num]
+            # (the entry block also has an implicit in-edge from the caller)
+            if len(reachable_preds) + (i == 0) < 2:
+                continue
+            for runner in reachable_preds:
+                while runner != self.idom[i]:
+                    self.frontier[runner].add(i)
+                    runner = self.idom[runner]
+
+    # For each block, the set of blocks that dominate it (not the other way
+    # around), derived from the idom array when first needed.
+    @cached_property
+    def doms(self):
+        doms = []
+        for i in range(self.n):
+            d = {i}
+            p = self.idom[i]
+            while p is not None:
+                d.add(p)
+                p = self.idom[p]
+            doms.append(d)
+        return doms
+
+    # The "other way around" (from above), that is, for each block, the set
+    # of blocks this block dominates
+    @cached_property
+    def dom_by(self):
+        dom_by = []
+        for i in range(self.n):
+            dom_by.append(set())
 
-            # This node is in the frontier for the remaining nodes:
-            for p in pre_doms:
-                self.frontier[p].add(i)
+        for i,d in enumerate(self.doms):
+            for mbr in d:
+                dom_by[mbr].add(i)
+        return dom_by
 
 
 
 
 
 def main():
-    prog = json.load(sys.stdin)
+    prog = load_prog()
 
     for func in prog['functions']:
 
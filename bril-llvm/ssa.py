@@ -59,7 +59,7 @@ def to_ssa(prog):
 
         g = CFG(func)
 
-        domins = Dominators(func)
+        domins = Dominators(func, g)
 
         defs = {}
         for i,b in enumerate(g.blocks):
@@ -165,6 +165,13 @@ def to_ssa(prog):
                 for j in range(count):
                     stack[var].pop()
 
+        # Blocks that are unreachable from the entry have no immediate
+        # dominator, so they are not in the dominator tree. Rename them as
+        # if the entry dominated them, so their uses still get new names.
+        for i in range(1, g.n):
+            if domins.idom[i] is None:
+                domins.dom_tree.setdefault(0, []).append(i)
+
         rename(0)
 
 
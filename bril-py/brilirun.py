@@ -0,0 +1,614 @@
+"""A Bril interpreter written in Python.
+
+The interpreter works directly on the canonical JSON representation of
+Bril programs, which it reads either as JSON or in the binary format
+from `bril-bin`. Before running a function, it decodes the instructions
+into compact tuples: the first element is the handler for the opcode,
+and label operands are resolved to instruction indices. The main loop
+dispatches through those handlers, so it never compares opcode strings
+or searches for labels.
+
+It supports the core language and the memory, floating-point, SSA, and
+speculation extensions. Use the `brilirun` command like `brili`, or
+call `run_prog` to interpret a program in-process.
+"""
+
+import json
+import math
+import sys
+
+__version__ = '0.0.1'
+
+
+class BrilError(Exception):
+    """A dynamic error in the interpreted program.
+    """
+
+
+# Memory.
+
+class Pointer:
+    """A pointer into the heap: an allocation number and an offset.
+    """
+    __slots__ = ('base', 'offset')
+
+    def __init__(self, base, offset):
+        self.base = base
+        self.offset = offset
+
+
+class Heap:
+    """Memory allocations, each a list of values, keyed by number.
+    """
+
+    def __init__(self):
+        self.storage = {}
+        self.next_base = 0
+
+    def alloc(self, amt):
+        if amt <= 0:
+            raise BrilError('cannot allocate {} entries'.format(amt))
+        base = self.next_base
+        self.next_base += 1
+        self.storage[base] = [None] * amt
+        return Pointer(base, 0)
+
+    def free(self, ptr):
+        if ptr.base in self.storage and ptr.offset == 0:
+            del self.storage[ptr.base]
+        else:
+            raise BrilError(
+                'Tried to free illegal memory location base: {}, offset: {}. '
+                'Offset must be 0.'.format(ptr.base, ptr.offset)
+            )
+
+    def data(self, ptr):
+        data = self.storage.get(ptr.base)
+        if data is None or not 0 <= ptr.offset < len(data):
+            raise BrilError(
+                'Uninitialized heap location {} and/or illegal offset {}'
+                .format(ptr.base, ptr.offset)
+            )
+        return data
+
+
+# Value formatting. Output matches the reference interpreter, which
+# prints values with JavaScript's `toString`.
+
+def _js_float(val):
+    """Format a float the way JavaScript's `Number.toString` does.
+    """
+    if math.isnan(val):
+        return 'NaN'
+    if math.isinf(val):
+        return 'Infinity' if val > 0 else '-Infinity'
+    if val == 0:
+        return '0'
+
+    # Python's `repr` also produces the shortest round-tripping digits;
+    # only the layout differs.
+    sign = '-' if val < 0 else ''
+    mantissa, _, exp = repr(abs(val)).partition('e')
+    whole, _, frac = mantissa.partition('.')
+    digits = whole + frac
+    point = len(whole) + (int(exp) if exp else 0)
+    stripped = digits.lstrip('0')
+    point -= len(digits) - len(stripped)
+    digits = stripped.rstrip('0')
+
+    k = len(digits)
+    if k <= point <= 21:
+        return sign + digits + '0' * (point - k)
+    elif 0 < point <= 21:
+        return sign + digits[:point] + '.' + digits[point:]
+    elif -6 < point <= 0:
+        return sign + '0.' + '0' * -point + digits
+    exp = point - 1
+    exp_str = 'e{}{}'.format('+' if exp >= 0 else '-', abs(exp))
+    if k == 1:
+        return sign + digits + exp_str
+    return sign + digits[0] + '.' + digits[1:] + exp_str
+
+
+def format_value(val):
+    if val is True:
+        return 'true'
+    elif val is False:
+        return 'false'
+    elif isinstance(val, int):
+        return str(val)
+    elif isinstance(val, float):
+        return _js_float(val)
+    else:
+        return '[object Object]'
+
+
+# Integer arithmetic wraps around at 64 bits.
+
+def _wrap(n):
+    return (n + 2**63) % 2**64 - 2**63
+
+
+def _div(a, b):
+    if b == 0:
+        raise BrilError('division by zero')
+    q = abs(a) // abs(b)
+    return _wrap(q if (a < 0) == (b < 0) else -q)
+
+
+def _fdiv(a, b):
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a == 0 or math.isnan(a):
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1, b)
+
+
+# Pure operations on values, by opcode.
+VALUE_OPS = {
+    'add': lambda a, b: _wrap(a + b),
+    'mul': lambda a, b: _wrap(a * b),
+    'sub': lambda a, b: _wrap(a - b),
+    'div': _div,
+    'eq': lambda a, b: a == b,
+    'lt': lambda a, b: a < b,
+    'gt': lambda a, b: a > b,
+    'le': lambda a, b: a <= b,
+    'ge': lambda a, b: a >= b,
+    'not': lambda a: not a,
+    'and': lambda a, b: a and b,
+    'or': lambda a, b: a or b,
+    'id': lambda a: a,
+    'fadd': lambda a, b: a + b,
+    'fmul': lambda a, b: a * b,
+    'fsub': lambda a, b: a - b,
+    'fdiv': _fdiv,
+    'feq': lambda a, b: a == b,
+    'flt': lambda a, b: a < b,
+    'fgt': lambda a, b: a > b,
+    'fle': lambda a, b: a <= b,
+    'fge': lambda a, b: a >= b,
+}
+
+
+# Interpreter state.
+
+class State:
+    """The state shared by all the function activations in a run.
+    """
+
+    def __init__(self, funcs, out):
+        self.funcs = funcs
+        self.out = out
+        self.heap = Heap()
+        self.icount = 0
+
+
+class Frame:
+    """A function activation: its variables and speculation state.
+    """
+    __slots__ = ('env', 'lastlabel', 'curlabel', 'specparent')
+
+    def __init__(self, env):
+        self.env = env
+        self.lastlabel = None
+        self.curlabel = None
+        self.specparent = None
+
+
+def _get(env, var):
+    try:
+        return env[var]
+    except KeyError:
+        raise BrilError('undefined variable {}'.format(var)) from None
+
+
+def _type_check(val, typ):
+    """Check whether a run-time value matches a static type.
+    """
+    if typ == 'int':
+        return isinstance(val, int) and not isinstance(val, bool)
+    elif typ == 'bool':
+        return isinstance(val, bool)
+    elif typ == 'float':
+        return isinstance(val, float)
+    elif isinstance(typ, dict) and 'ptr' in typ:
+        return isinstance(val, Pointer)
+    raise BrilError('unknown type {}'.format(typ))
+
+
+def _ptr(val, op):
+    if not isinstance(val, Pointer):
+        raise BrilError('{} argument must be a Pointer'.format(op))
+    return val
+
+
+# Instruction handlers. Every handler takes the state, the frame, and
+# the decoded instruction and returns the index of the next instruction
+# to run, or None to fall through. Returning from the function raises
+# `_Return`.
+
+class _Return(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+def _h_value(state, frame, instr):
+    _, dest, args, fn = instr
+    env = frame.env
+    env[dest] = fn(*[_get(env, a) for a in args])
+
+
+def _h_const(state, frame, instr):
+    frame.env[instr[1]] = instr[2]
+
+
+def _h_label(state, frame, instr):
+    # Labels are only run when control falls through to them (jumps do
+    # this bookkeeping themselves), and they do not count as executed
+    # instructions.
+    state.icount -= 1
+    frame.lastlabel = frame.curlabel
+    frame.curlabel = instr[1]
+
+
+def _h_jmp(state, frame, instr):
+    frame.lastlabel = frame.curlabel
+    frame.curlabel = instr[2]
+    return instr[1]
+
+
+def _h_br(state, frame, instr):
+    _, cond, t, t_label, f, f_label = instr
+    frame.lastlabel = frame.curlabel
+    if _get(frame.env, cond):
+        frame.curlabel = t_label
+        return t
+    else:
+        frame.curlabel = f_label
+        return f
+
+
+def _h_ret(state, frame, instr):
+    args = instr[1]
+    if frame.specparent is not None:
+        raise BrilError('ret not allowed during speculation')
+    raise _Return(_get(frame.env, args[0]) if args else None)
+
+
+def _h_print(state, frame, instr):
+    env = frame.env
+    state.out.write(
+        ' '.join(format_value(_get(env, a)) for a in instr[1]) + '\n'
+    )
+
+
+def _h_nop(state, frame, instr):
+    pass
+
+
+def _h_call(state, frame, instr):
+    _, dest, type, args, name = instr
+    if frame.specparent is not None:
+        raise BrilError('call not allowed during speculation')
+    if name not in state.funcs:
+        raise BrilError('no function of name {} found'.format(name))
+    func = state.funcs[name]
+    if len(func.params) != len(args):
+        raise BrilError('function expected {} arguments, got {}'.format(
+            len(func.params), len(args)
+        ))
+    env = frame.env
+    new_env = {}
+    for (param, param_type), arg in zip(func.params, args):
+        val = _get(env, arg)
+        if not _type_check(val, param_type):
+            raise BrilError('function argument type mismatch')
+        new_env[param] = val
+    value = eval_func(state, func, new_env)
+    if dest is None:
+        if value is not None:
+            raise BrilError('unexpected value returned without destination')
+    else:
+        if value is None:
+            raise BrilError(
+                'non-void function (type: {}) doesn\'t return anything'
+                .format(func.type)
+            )
+        if not _type_check(value, type):
+            raise BrilError('type of value returned by function does not '
+                            'match destination type')
+        if func.type != type:
+            raise BrilError('type of value returned by function does not '
+                            'match declaration')
+        env[dest] = value
+
+
+def _h_alloc(state, frame, instr):
+    frame.env[instr[1]] = state.heap.alloc(_get(frame.env, instr[2]))
+
+
+def _h_free(state, frame, instr):
+    state.heap.free(_ptr(_get(frame.env, instr[1]), 'free'))
+
+
+def _h_store(state, frame, instr):
+    env = frame.env
+    ptr = _ptr(_get(env, instr[1]), 'store')
+    state.heap.data(ptr)[ptr.offset] = _get(env, instr[2])
+
+
+def _h_load(state, frame, instr):
+    env = frame.env
+    ptr = _ptr(_get(env, instr[2]), 'load')
+    val = state.heap.data(ptr)[ptr.offset]
+    if val is None:
+        raise BrilError('Pointer {} points to uninitialized data'.format(
+            instr[2]
+        ))
+    env[instr[1]] = val
+
+
+def _h_ptradd(state, frame, instr):
+    env = frame.env
+    ptr = _ptr(_get(env, instr[2]), 'ptradd')
+    env[instr[1]] = Pointer(ptr.base, ptr.offset + _get(env, instr[3]))
+
+
+def _h_phi(state, frame, instr):
+    _, dest, sources = instr
+    if frame.lastlabel is None:
+        raise BrilError('phi node executed with no last label')
+    src = sources.get(frame.lastlabel)
+    env = frame.env
+    if src is None or src not in env:
+        env.pop(dest, None)  # Leave the destination undefined.
+    else:
+        env[dest] = env[src]
+
+
+def _h_speculate(state, frame, instr):
+    parent = Frame(frame.env)
+    parent.lastlabel = frame.lastlabel
+    parent.curlabel = frame.curlabel
+    parent.specparent = frame.specparent
+    frame.specparent = parent
+    frame.env = dict(frame.env)
+
+
+def _h_commit(state, frame, instr):
+    if frame.specparent is None:
+        raise BrilError('commit in non-speculative state')
+    frame.specparent = frame.specparent.specparent
+
+
+def _h_guard(state, frame, instr):
+    if _get(frame.env, instr[1]):
+        return None
+    parent = frame.specparent
+    if parent is None:
+        raise BrilError('abort in non-speculative state')
+    frame.env = parent.env
+    frame.lastlabel = parent.lastlabel
+    frame.curlabel = parent.curlabel
+    frame.specparent = parent.specparent
+    frame.lastlabel = frame.curlabel
+    frame.curlabel = instr[3]
+    return instr[2]
+
+
+# Decoding.
+
+class Function:
+    """A decoded function, ready to run. `params` is a list of
+    `(name, type)` pairs.
+    """
+    __slots__ = ('name', 'params', 'type', 'code')
+
+    def __init__(self, name, params, type, code):
+        self.name = name
+        self.params = params
+        self.type = type
+        self.code = code
+
+
+def decode_func(func):
+    """Decode a JSON function into a `Function`.
+    """
+    instrs = func['instrs']
+
+    # Jumps go to the instruction just after the target label.
+    labels = {}
+    for i, instr in enumerate(instrs):
+        if 'label' in instr:
+            labels.setdefault(instr['label'], i + 1)
+
+    def target(label):
+        if label not in labels:
+            raise BrilError('label {} not found'.format(label))
+        return labels[label]
+
+    code = []
+    for instr in instrs:
+        if 'label' in instr:
+            code.append((_h_label, instr['label']))
+            continue
+
+        op = instr['op']
+        args = tuple(instr.get('args', ()))
+        dest = instr.get('dest')
+        if op == 'const':
+            value = instr['value']
+            if instr.get('type') == 'float':
+                value = float(value)
+            elif not isinstance(value, bool):
+                value = math.floor(value)
+            code.append((_h_const, dest, value))
+        elif op in VALUE_OPS:
+            code.append((_h_value, dest, args, VALUE_OPS[op]))
+        elif op == 'jmp':
+            label = instr['labels'][0]
+            code.append((_h_jmp, target(label), label))
+        elif op == 'br':
+            t, f = instr['labels']
+            code.append((_h_br, args[0], target(t), t, target(f), f))
+        elif op == 'ret':
+            code.append((_h_ret, args))
+        elif op == 'print':
+            code.append((_h_print, args))
+        elif op == 'nop':
+            code.append((_h_nop,))
+        elif op == 'call':
+            code.append((_h_call, dest, instr.get('type'), args,
+                         instr['funcs'][0]))
+        elif op == 'alloc':
+            code.append((_h_alloc, dest, args[0]))
+        elif op == 'free':
+            code.append((_h_free, args[0]))
+        elif op == 'store':
+            code.append((_h_store, args[0], args[1]))
+        elif op == 'load':
+            code.append((_h_load, dest, args[0]))
+        elif op == 'ptradd':
+            code.append((_h_ptradd, dest, args[0], args[1]))
+        elif op == 'phi':
+            labels_ = instr.get('labels', [])
+            if len(labels_) != len(args):
+                raise BrilError(
+                    'phi node has unequal numbers of labels and args'
+                )
+            code.append((_h_phi, dest, dict(zip(labels_, args))))
+        elif op == 'speculate':
+            code.append((_h_speculate,))
+        elif op == 'commit':
+            code.append((_h_commit,))
+        elif op == 'guard':
+            label = instr['labels'][0]
+            code.append((_h_guard, args[0], target(label), label))
+        else:
+            raise BrilError('unknown opcode {}'.format(op))
+
+    params = [(a['name'], a['type']) for a in func.get('args', [])]
+    return Function(func['name'], params, func.get('type'), code)
+
+
+def eval_func(state, func, env):
+    """Run a decoded function with the given variables and return its
+    return value (or None).
+    """
+    frame = Frame(env)
+    code = func.code
+    n = len(code)
+    pc = 0
+    count = 0
+    try:
+        while pc < n:
+            instr = code[pc]
+            count += 1
+            target = instr[0](state, frame, instr)
+            pc = pc + 1 if target is None else target
+    except _Return as ret:
+        return ret.value
+    finally:
+        state.icount += count
+
+    if frame.specparent is not None:
+        raise BrilError('implicit return in speculative state')
+    return None
+
+
+def _parse_arg(text, type):
+    if type == 'int':
+        try:
+            return int(text)
+        except ValueError:
+            raise BrilError(
+                'int argument to main must be an integer; got {}'
+                .format(text)
+            ) from None
+    elif type == 'bool':
+        if text not in ('true', 'false'):
+            raise BrilError(
+                "boolean argument to main must be 'true'/'false'; got {}"
+                .format(text)
+            )
+        return text == 'true'
+    elif type == 'float':
+        try:
+            val = float(text)
+        except ValueError:
+            val = math.nan
+        if math.isnan(val):
+            raise BrilError(
+                "float argument to main must not be 'NaN'; got {}"
+                .format(text)
+            )
+        return val
+    raise BrilError('unknown type {}'.format(type))
+
+
+def run_prog(bril, args=(), out=None):
+    """Interpret a Bril program in-process.
+
+    Run its `main` function with `args` (strings, as on the command
+    line). Printed output goes to `out` (default: stdout). Return the
+    number of dynamic instructions executed.
+    """
+    funcs = {}
+    for func in bril['functions']:
+        if func['name'] in funcs:
+            raise BrilError('multiple functions of name {} found'.format(
+                func['name']
+            ))
+        funcs[func['name']] = decode_func(func)
+    if 'main' not in funcs:
+        raise BrilError('no function of name main found')
+
+    main = funcs['main']
+    main_args = next(f for f in bril['functions'] if f['name'] == 'main')
+    main_args = main_args.get('args', [])
+    if len(args) != len(main_args):
+        raise BrilError(
+            'mismatched main argument arity: expected {}; got {}'
+            .format(len(main_args), len(args))
+        )
+    env = {a['name']: _parse_arg(v, a['type'])
+           for a, v in zip(main_args, args)}
+
+    state = State(funcs, out or sys.stdout)
+    eval_func(state, main, env)
+    if state.heap.storage:
+        raise BrilError(
+            'Some memory locations have not been freed by end of execution.'
+        )
+    return state.icount
+
+
+def brilirun():
+    args = sys.argv[1:]
+    profile = '-p' in args
+    if profile:
+        args.remove('-p')
+
+    # Bril recursion turns into Python recursion.
+    sys.setrecursionlimit(100000)
+
+    import brilbin
+    if brilbin.is_binary(sys.stdin.buffer):
+        # The binary format from bril-bin.
+        bril = brilbin.load(sys.stdin.buffer)
+    else:
+        bril = json.load(sys.stdin)
+    try:
+        icount = run_prog(bril, args)
+    except BrilError as e:
+        sys.stdout.flush()
+        print('error: {}'.format(e), file=sys.stderr)
+        sys.exit(2)
+    if profile:
+        print('total_dyn_inst: {}'.format(icount), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    brilirun()
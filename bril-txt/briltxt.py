@@ -22,8 +22,8 @@ start: (struct | func)*
 struct: STRUCT IDENT "=" "{" mbr* "}"
 mbr: IDENT ":" type ";"
 
-func: FUNC ["(" arg_list? ")"] [tyann] "{" instr* "}"
-arg_list: | arg ("," arg)*
+func: FUNC ["(" arg_list ")"] [tyann] "{" instr* "}"
+arg_list: (arg ("," arg)*)?
 arg: IDENT ":" type
 ?instr: const | vop | eop | label
 
@@ -211,14 +211,34 @@ class JSONTransformer(lark.Transformer):
         return 0
 
 
+_parsers = {}
+
+
+def get_parser(include_pos=False):
+    """Get an LALR parser that produces the JSON representation directly,
+    without building a parse tree.
+
+    Each parser is only built once per process. Lark also caches the
+    parser tables on disk (in the temporary directory), so later runs
+    can load them instead of analyzing the grammar again.
+    """
+    if include_pos not in _parsers:
+        _parsers[include_pos] = lark.Lark(
+            GRAMMAR,
+            parser='lalr',
+            maybe_placeholders=True,
+            transformer=JSONTransformer(include_pos),
+            cache=True,
+        )
+    return _parsers[include_pos]
+
+
 def parse_bril(txt, include_pos=False):
     """Parse a Bril program and return a JSON string.
 
     Optionally include source position information.
     """
-    parser = lark.Lark(GRAMMAR, maybe_placeholders=True)
-    tree = parser.parse(txt)
-    data = JSONTransformer(include_pos).transform(tree)
+    data = get_parser(include_pos).parse(txt)
     return json.dumps(data, indent=2, sort_keys=True)
 
 
@@ -233,47 +253,31 @@ def type_to_str(type):
         return type
 
 
+def _tyann(instr):
+    if 'type' in instr:
+        return ': ' + type_to_str(instr['type'])
+    return ''
+
+
 def instr_to_string(instr):
     if instr['op'] == 'const':
-        tyann = ': {}'.format(type_to_str(instr['type'])) \
-            if 'type' in instr else ''
-        return '{}{} = const {}'.format(
-            instr['dest'],
-            tyann,
-            str(instr['value']).lower(),
-        )
+        return instr['dest'] + _tyann(instr) + ' = const ' + \
+            str(instr['value']).lower()
     else:
-        rhs = instr['op']
+        parts = [instr['op']]
         if instr.get('funcs'):
-            rhs += ' {}'.format(' '.join(
-                '@{}'.format(f) for f in instr['funcs']
-            ))
+            parts.extend('@' + f for f in instr['funcs'])
         if instr.get('args'):
-            rhs += ' {}'.format(' '.join(instr['args']))
+            parts.extend(instr['args'])
         if instr.get('labels'):
-            rhs += ' {}'.format(' '.join(
-                '.{}'.format(f) for f in instr['labels']
-            ))
+            parts.extend('.' + f for f in instr['labels'])
+        rhs = ' '.join(parts)
         if 'dest' in instr:
-            tyann = ': {}'.format(type_to_str(instr['type'])) \
-                if 'type' in instr else ''
-            return '{}{} = {}'.format(
-                instr['dest'],
-                tyann,
-                rhs,
-            )
+            return instr['dest'] + _tyann(instr) + ' = ' + rhs
         else:
             return rhs
 
 
-def print_instr(instr):
-    print('  {};'.format(instr_to_string(instr)))
-
-
-def print_label(label):
-    print('.{}:'.format(label['label']))
-
-
 def args_to_string(args):
     if args:
         return '({})'.format(', '.join(
@@ -284,24 +288,76 @@ def args_to_string(args):
         return ''
 
 
-def print_func(func):
+def func_to_lines(func):
+    """Generate the lines of text (without newlines) for a function.
+    """
     typ = func.get('type', 'void')
-    print('@{}{}{} {{'.format(
+    yield '@{}{}{} {{'.format(
         func['name'],
         args_to_string(func.get('args', [])),
         ': {}'.format(type_to_str(typ)) if typ != 'void' else '',
-    ))
+    )
     for instr_or_label in func['instrs']:
         if 'label' in instr_or_label:
-            print_label(instr_or_label)
+            yield '.' + instr_or_label['label'] + ':'
         else:
-            print_instr(instr_or_label)
-    print('}')
+            yield '  ' + instr_to_string(instr_or_label) + ';'
+    yield '}'
+
+
+def write_funcs(funcs, out, chunk_size=1 << 16):
+    """Write functions in the text format to the text stream `out`.
+
+    `funcs` can be any iterable, such as a generator that decodes
+    functions as they are needed (see `load_funcs`). Each function is
+    written as soon as it has been rendered, but text is only written to
+    the stream in chunks of about `chunk_size` characters.
+    """
+    buf = []
+    size = 0
+    for func in funcs:
+        for line in func_to_lines(func):
+            buf.append(line)
+            size += len(line)
+        if size >= chunk_size:
+            buf.append('')
+            out.write('\n'.join(buf))
+            buf = []
+            size = 0
+    if buf:
+        buf.append('')
+        out.write('\n'.join(buf))
+
+
+def write_prog(prog, out):
+    """Write a program in the text format to the text stream `out`.
+    """
+    write_funcs(prog['functions'], out)
+
+
+def print_instr(instr):
+    print('  {};'.format(instr_to_string(instr)))
+
+
+def print_label(label):
+    print('.{}:'.format(label['label']))
+
+
+def print_func(func):
+    write_funcs([func], sys.stdout)
 
 
 def print_prog(prog):
-    for func in prog['functions']:
-        print_func(func)
+    write_prog(prog, sys.stdout)
+
+
+def load_funcs(stream, other=None, chunk_size=1 << 16):
+    """Decode the functions in a JSON Bril program from a text stream,
+    yielding each one as soon as it has been read (see
+    `brilbin.load_json_funcs`).
+    """
+    import brilbin
+    return brilbin.load_json_funcs(stream, other, chunk_size)
 
 
 # Command-line entry points.
@@ -311,4 +367,4 @@ def bril2json():
 
 
 def bril2txt():
-    print_prog(json.load(sys.stdin))
+    write_funcs(load_funcs(sys.stdin), sys.stdout)
@@ -0,0 +1,173 @@
+"""Aggressive dead code elimination for Bril functions, meant for SSA
+form (as produced by `to_ssa.py`).
+
+Instead of deleting unused instructions until nothing changes, as
+`tdce.py` does, this pass marks the instructions that matter in one
+sweep over the def-use chains and deletes the rest. The roots are the
+instructions with effects: everything without a destination (such as
+`print`, `store`, and `ret`) and every `call`. An instruction that a
+marked instruction uses is marked too. Values that only feed each other,
+like a phi-node cycle for a loop counter that is never read, are never
+marked, so they go away as well. (Outside SSA form, a use marks every
+assignment to the variable, which is still correct, just less precise.)
+
+With `--control`, branches are not roots either. A branch is marked only
+if a marked instruction is control dependent on it (or a marked phi-node
+needs to know which way it went), and every other branch becomes a jump
+to its block's immediate postdominator. The blocks that are no longer
+reachable are deleted. This also deletes loops that compute nothing
+that is used, assuming that they terminate. Functions with blocks that
+cannot reach a `ret` have no postdominators, so their branches are
+always kept.
+"""
+
+import sys
+
+from cfg import CFG, reassemble
+from dom import Dominators, postorder
+from util import cached, jobs_arg, modify_funcs
+
+
+def _is_root(instr, control):
+    op = instr['op']
+    if op == 'call':
+        return True
+    if 'dest' in instr or op in ('jmp', 'nop'):
+        return False
+    return op != 'br' or not control
+
+
+def postdominators(g):
+    """Get the postdominators of an indexed CFG: a `Dominators` for the
+    reversed CFG, with a node numbered `len(g.blocks)` for the exit that
+    every `ret` goes to. Return None if some block that is reachable from
+    the entry cannot reach the exit.
+    """
+    exit = len(g.blocks)
+    rsucc = {i: preds for i, preds in enumerate(g.pred)}
+    rsucc[exit] = [i for i, block in enumerate(g.blocks)
+                   if block[-1]['op'] == 'ret']
+    pdoms = Dominators(rsucc, exit)
+    succ = dict(enumerate(g.succ))
+    if any(b not in pdoms.index for b in postorder(succ, 0)):
+        return None
+    return pdoms
+
+
+def adce_func(func, control=False):
+    """Delete the instructions in a function that do not contribute to
+    its effects. If `control` is true, also turn branches that nothing
+    depends on into jumps.
+    """
+    g = CFG(func['instrs'])
+    if not g.blocks:
+        return
+    blocks = g.blocks
+    pdoms = postdominators(g) if control else None
+    deps = pdoms.fronts() if pdoms else None
+
+    defs = {}
+    for b, block in enumerate(blocks):
+        for i, instr in enumerate(block):
+            if 'dest' in instr:
+                defs.setdefault(instr['dest'], []).append((b, i))
+
+    marked = [[False] * len(block) for block in blocks]
+    live = [False] * len(blocks)  # Blocks with marked instructions.
+    work = []
+
+    def mark(b, i):
+        if not marked[b][i]:
+            marked[b][i] = True
+            work.append((b, i))
+
+    for b, block in enumerate(blocks):
+        for i, instr in enumerate(block):
+            if _is_root(instr, deps is not None):
+                mark(b, i)
+
+    while work:
+        b, i = work.pop()
+        instr = blocks[b][i]
+        for arg in instr.get('args', []):
+            for d in defs.get(arg, ()):
+                mark(*d)
+        if deps is None:
+            continue
+
+        # The branches that decide whether this block runs are needed,
+        # and so are the ones that decide which argument a phi-node
+        # takes: those at the ends of its predecessors.
+        if instr['op'] == 'phi':
+            for label in instr['labels']:
+                p = g.index.get(label)
+                if p is not None:
+                    mark(p, len(blocks[p]) - 1)
+        if not live[b]:
+            live[b] = True
+            for c in deps.get(b, ()):
+                mark(c, len(blocks[c]) - 1)
+
+    for b, block in enumerate(blocks):
+        new_block = []
+        for i, instr in enumerate(block):
+            if marked[b][i] or instr['op'] == 'jmp':
+                new_block.append(instr)
+            elif instr['op'] == 'br':
+                # No marked instruction lies between here and the
+                # immediate postdominator, so go straight there.
+                if b not in pdoms.index:
+                    # An unreachable block with no postdominators.
+                    new_block.append(instr)
+                    continue
+                ipdom = pdoms.nodes[pdoms.idom[pdoms.index[b]]]
+                if ipdom == len(blocks):
+                    new_block.append(instr)
+                else:
+                    new_block.append({'op': 'jmp',
+                                      'labels': [g.names[ipdom]]})
+        block[:] = new_block
+
+    keep = range(len(blocks))
+    if deps is not None:
+        keep = _reachable(g)
+        names = {g.names[b] for b in keep}
+        for b in keep:
+            for instr in blocks[b]:
+                if instr['op'] == 'phi':
+                    pairs = [(label, arg) for label, arg
+                             in zip(instr['labels'], instr['args'])
+                             if label in names]
+                    instr['labels'] = [label for label, _ in pairs]
+                    instr['args'] = [arg for _, arg in pairs]
+    func['instrs'] = reassemble({g.names[b]: blocks[b] for b in keep})
+
+
+def _reachable(g):
+    """Get the numbers of the blocks that are still reachable from the
+    entry (or the target of a `guard`), in order.
+    """
+    seen = {0}
+    stack = [0]
+    while stack:
+        b = stack.pop()
+        for instr in g.blocks[b]:
+            if 'labels' not in instr or instr['op'] == 'phi':
+                continue
+            for label in instr['labels']:
+                s = g.index[label]
+                if s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+    return sorted(seen)
+
+
+# `adce_func` can delete blocks, so it keeps no analyses valid.
+PRESERVES = frozenset()
+
+
+if __name__ == '__main__':
+    control = '--control' in sys.argv[1:]
+    modify_funcs(cached(lambda func: adce_func(func, control),
+                        ['adce', control]),
+                 jobs=jobs_arg(sys.argv[1:]))
@@ -0,0 +1,119 @@
+"""Cache analysis results for functions across passes.
+
+An `AnalysisManager` computes each analysis in `ANALYSES` for a function
+the first time a pass asks for it and hands out the same result until
+it is invalidated. After changing a function, a pass (or whatever runs
+it) calls `invalidate` with the set of analyses that the change keeps
+valid. The other results are recomputed the next time they are needed.
+Each pass module says which analyses its pass preserves in a
+`PRESERVES` set.
+
+Results are shared, so passes must not modify them unless they preserve
+them: for example, `to_ssa` rewrites the blocks of the `'cfg'` result in
+place, and then the function's instructions are made of those same
+blocks, so the result stays valid.
+"""
+
+from collections import Counter, namedtuple
+
+import cfg
+from df import df_worklist, BIT_ANALYSES
+from dom import Dominators
+from loops import natural_loops
+
+# The results of live variable analysis as bit-vectors: maps from block
+# names to the variables live on entry to and on exit from the block,
+# and the `VarBits` that gives the variables' bits.
+Liveness = namedtuple('Liveness', ['live_in', 'live_out', 'var_bits'])
+
+
+def _cfg(am, func):
+    return cfg.CFG(func['instrs']).block_map()
+
+
+def _dominators(am, func):
+    blocks = am.get(func, 'cfg')
+    _, succs = am.get(func, 'edges')
+    return Dominators(succs, next(iter(blocks)))
+
+
+def _loops(am, func):
+    _, succs = am.get(func, 'edges')
+    return natural_loops(succs, am.get(func, 'dominators'))
+
+
+def _live(am, func):
+    blocks = am.get(func, 'cfg')
+    analysis, var_bits = BIT_ANALYSES['live'](blocks)
+    live_in, live_out = df_worklist(blocks, analysis)
+    return Liveness(live_in, live_out, var_bits)
+
+
+# Each analysis takes the manager (to get the analyses it builds on) and
+# a function.
+ANALYSES = {
+    # The block map, with a unique entry block and a terminator at the
+    # end of every block.
+    'cfg': _cfg,
+
+    # Predecessor and successor maps for the blocks.
+    'edges': lambda am, func: cfg.edges(am.get(func, 'cfg')),
+
+    # A `Dominators` for the blocks. It also provides the dominator
+    # tree and the dominance frontiers.
+    'dominators': _dominators,
+    'frontiers': lambda am, func: am.get(func, 'dominators').fronts(),
+
+    # The natural loops, outermost first (see `loops.natural_loops`).
+    'loops': _loops,
+
+    # A `Liveness`.
+    'live': _live,
+}
+
+# The analyses that depend only on the CFG's shape, which a pass keeps
+# valid if it never adds, removes, or reorders blocks or changes their
+# terminators' targets.
+CFG_SHAPE = frozenset({'edges', 'dominators', 'frontiers', 'loops'})
+
+
+class AnalysisManager:
+    """Compute analyses on demand and cache them per function.
+
+    Functions are identified by name, and a cached result is only used
+    for the same function object it was computed for. `computed` counts
+    how many times each analysis has been computed.
+    """
+
+    def __init__(self):
+        self._results = {}
+        self.computed = Counter()
+
+    def _cache(self, func):
+        entry = self._results.get(func['name'])
+        if entry is None or entry[0] is not func:
+            entry = self._results[func['name']] = (func, {})
+        return entry[1]
+
+    def get(self, func, name):
+        """Get the result of an analysis on a function.
+        """
+        results = self._cache(func)
+        if name not in results:
+            results[name] = ANALYSES[name](self, func)
+            self.computed[name] += 1
+        return results[name]
+
+    def invalidate(self, func, preserved=()):
+        """Forget the results for a function that has changed, except
+        for the `preserved` analyses.
+        """
+        results = self._cache(func)
+        for name in list(results):
+            if name not in preserved:
+                del results[name]
+
+    def forget(self, func):
+        """Drop everything cached for a function.
+        """
+        self._results.pop(func['name'], None)
@@ -1,6 +1,6 @@
-from collections import OrderedDict
-from util import fresh, flatten
-from form_blocks import TERMINATORS
+from collections import Counter, OrderedDict
+from util import Fresh
+from form_blocks import form_blocks, TERMINATORS
 
 
 def block_map(blocks):
@@ -13,6 +13,8 @@ def block_map(blocks):
     labels removed.
     """
     by_name = OrderedDict()
+    blocks = list(blocks)
+    fresh = Fresh({b[0]['label'] for b in blocks if 'label' in b[0]})
 
     for block in blocks:
         # Generate a name for the block.
@@ -22,8 +24,9 @@ def block_map(blocks):
             name = block[0]['label']
             block = block[1:]
         else:
-            # Make up a new name for this anonymous block.
-            name = fresh('b', by_name)
+            # Make up a new name for this anonymous block. (It must not
+            # be the label of any block, even one that comes later.)
+            name = fresh('b')
 
         # Add the block to the mapping.
         by_name[name] = block
@@ -49,21 +52,15 @@ def add_terminators(blocks):
     """Given an ordered block map, modify the blocks to add terminators
     to all blocks (avoiding "fall-through" control flow transfers).
     """
+    names = list(blocks)
     for i, block in enumerate(blocks.values()):
-        if not block:
-            if i == len(blocks) - 1:
+        if not block or block[-1]['op'] not in TERMINATORS:
+            if i == len(names) - 1:
                 # In the last block, return.
                 block.append({'op': 'ret', 'args': []})
-            else:
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
-        elif block[-1]['op'] not in TERMINATORS:
-            if i == len(blocks) - 1:
-                block.append({'op': 'ret', 'args': []})
             else:
                 # Otherwise, jump to the next block.
-                dest = list(blocks.keys())[i + 1]
-                block.append({'op': 'jmp', 'labels': [dest]})
+                block.append({'op': 'jmp', 'labels': [names[i + 1]]})
 
 
 def add_entry(blocks):
@@ -75,15 +72,15 @@ def add_entry(blocks):
     """
     first_lbl = next(iter(blocks.keys()))
 
-    # Check for any references to the label.
-    for instr in flatten(blocks.values()):
-        if 'labels' in instr and first_lbl in instr['labels']:
-            break
-    else:
+    # Check for any references to the label. (The labels of a phi-node
+    # name predecessors; they are not edges.)
+    if not any(first_lbl in instr['labels']
+               for block in blocks.values() for instr in block
+               if 'labels' in instr and instr.get('op') != 'phi'):
         return
 
     # References exist; insert a new block.
-    new_lbl = fresh('entry', blocks)
+    new_lbl = Fresh(set(blocks))('entry')
     blocks[new_lbl] = []
     blocks.move_to_end(new_lbl, last=False)
 
@@ -111,3 +108,72 @@ def reassemble(blocks):
         instrs.append({'label': name})
         instrs += block
     return instrs
+
+
+class CFG:
+    """An indexed control-flow graph for a list of instructions, built in
+    linear time.
+
+    The blocks are named as by `block_map`, with an entry block added as
+    by `add_entry` and terminators as by `add_terminators`, and numbered
+    in order. `names` lists their names and `index` maps names back to
+    numbers. `blocks` holds their instructions, without labels. `succ`
+    and `pred` list each block's successors and predecessors by number.
+    `refs` counts the references to each label from instructions other
+    than phi-nodes. `fresh` generates names that are not yet taken.
+
+    For code that works on block maps, `block_map` and `edges` give the
+    same results as the functions of the same names, sharing the blocks'
+    instruction lists.
+    """
+
+    def __init__(self, instrs):
+        self.fresh = Fresh({i['label'] for i in instrs if 'label' in i})
+        self.names = names = []
+        self.blocks = blocks = []
+        self.refs = refs = Counter()
+        for block in form_blocks(instrs):
+            if 'label' in block[0]:
+                names.append(block[0]['label'])
+                block = block[1:]
+            else:
+                names.append(self.fresh('b'))
+            blocks.append(block)
+            for instr in block:
+                if 'labels' in instr and instr.get('op') != 'phi':
+                    refs.update(instr['labels'])
+
+        if names and refs[names[0]]:
+            names.insert(0, self.fresh('entry'))
+            blocks.insert(0, [])
+
+        for i, block in enumerate(blocks):
+            if not block or block[-1]['op'] not in TERMINATORS:
+                if i == len(blocks) - 1:
+                    block.append({'op': 'ret', 'args': []})
+                else:
+                    block.append({'op': 'jmp', 'labels': [names[i + 1]]})
+                    refs[names[i + 1]] += 1
+
+        self.index = index = {name: i for i, name in enumerate(names)}
+        self.succ = [[index[s] for s in successors(block[-1])]
+                     for block in blocks]
+        self.pred = [[] for _ in blocks]
+        for i, ss in enumerate(self.succ):
+            for s in ss:
+                self.pred[s].append(i)
+
+    def block_map(self):
+        """Get an `OrderedDict` mapping names to blocks.
+        """
+        return OrderedDict(zip(self.names, self.blocks))
+
+    def edges(self):
+        """Get the predecessor and successor maps by name, like `edges`.
+        """
+        names = self.names
+        preds = {names[i]: [names[p] for p in ps]
+                 for i, ps in enumerate(self.pred)}
+        succs = {names[i]: [names[s] for s in ss]
+                 for i, ss in enumerate(self.succ)}
+        return preds, succs
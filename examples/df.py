@@ -1,9 +1,12 @@
 import sys
-import json
-from collections import namedtuple
+import heapq
+from collections import namedtuple, deque
 
 from form_blocks import form_blocks
+from dom import postorder
 import cfg
+import ir
+from util import load_bril
 
 # A single dataflow analysis consists of these part:
 # - forward: True for forward, False for backward.
@@ -20,11 +23,88 @@ def union(sets):
     return out
 
 
-def df_worklist(blocks, analysis):
+class FifoWorklist:
+    """A first-in, first-out worklist. A block is never queued more than
+    once at a time.
+    """
+
+    def __init__(self, nodes):
+        self._queue = deque(nodes)
+        self._queued = set(self._queue)
+
+    def push(self, node):
+        if node not in self._queued:
+            self._queued.add(node)
+            self._queue.append(node)
+
+    def pop(self):
+        node = self._queue.popleft()
+        self._queued.remove(node)
+        return node
+
+    def __bool__(self):
+        return bool(self._queue)
+
+
+class PriorityWorklist:
+    """A worklist that always produces the queued block that comes first
+    in a fixed order. A block is never queued more than once at a time.
+    """
+
+    def __init__(self, nodes, order):
+        self._order = list(order)
+        self._rank = {node: i for i, node in enumerate(self._order)}
+        self._heap = sorted(self._rank[node] for node in nodes)
+        self._queued = set(self._heap)
+
+    def push(self, node):
+        rank = self._rank[node]
+        if rank not in self._queued:
+            self._queued.add(rank)
+            heapq.heappush(self._heap, rank)
+
+    def pop(self):
+        rank = heapq.heappop(self._heap)
+        self._queued.remove(rank)
+        return self._order[rank]
+
+    def __bool__(self):
+        return bool(self._heap)
+
+
+def rpo_order(blocks, succs, forward):
+    """Get the order in which a priority worklist should visit blocks:
+    reverse postorder for forward analyses and postorder for backward
+    analyses. Blocks unreachable from the entry go last (first, for
+    backward analyses) in their original order.
+    """
+    entry = next(iter(blocks))
+    order = list(reversed(postorder(succs, entry)))
+    reached = set(order)
+    order += [name for name in blocks if name not in reached]
+    return order if forward else list(reversed(order))
+
+
+# Worklist strategies. Each takes the block map, the successor map, and
+# the analysis direction and produces a worklist containing every block.
+WORKLISTS = {
+    'fifo': lambda blocks, succs, forward: FifoWorklist(blocks),
+    'rpo': lambda blocks, succs, forward:
+        PriorityWorklist(blocks, rpo_order(blocks, succs, forward)),
+}
+
+
+def df_worklist(blocks, analysis, strategy='rpo', stats=None,
+                edges=cfg.edges):
     """The worklist algorithm for iterating a data flow analysis to a
     fixed point.
+
+    `strategy` names the worklist in `WORKLISTS` that decides which
+    block to visit next. If `stats` is a dict, the number of blocks
+    visited is stored in it under `'iterations'`. For blocks of
+    `ir.Instr`, pass `ir.edges` as `edges`.
     """
-    preds, succs = cfg.edges(blocks)
+    preds, succs = edges(blocks)
 
     # Switch between directions.
     if analysis.forward:
@@ -41,9 +121,11 @@ def df_worklist(blocks, analysis):
     out = {node: analysis.init for node in blocks}
 
     # Iterate.
-    worklist = list(blocks.keys())
+    worklist = WORKLISTS[strategy](blocks, succs, analysis.forward)
+    iterations = 0
     while worklist:
-        node = worklist.pop(0)
+        node = worklist.pop()
+        iterations += 1
 
         inval = analysis.merge(out[n] for n in in_edges[node])
         in_[node] = inval
@@ -52,7 +134,11 @@ def df_worklist(blocks, analysis):
 
         if outval != out[node]:
             out[node] = outval
-            worklist += out_edges[node]
+            for n in out_edges[node]:
+                worklist.push(n)
+
+    if stats is not None:
+        stats['iterations'] = iterations
 
     if analysis.forward:
         return in_, out
@@ -79,18 +165,51 @@ def fmt(val):
         return str(val)
 
 
-def run_df(bril, analysis):
+def run_df(bril, analysis, strategy='rpo', report=False, use_ir=False):
+    """Run a data flow analysis on every function and print the results.
+
+    `analysis` is either an `Analysis` or, for bit-vector analyses, a
+    function that builds an `Analysis` and a `VarBits` from a block map.
+    With `use_ir`, it is instead one of `IR_BIT_ANALYSES`, and the
+    analysis runs on the `ir` form of each function.
+    """
+    total = 0
     for func in bril['functions']:
+        stats = {}
+        if use_ir:
+            f = ir.from_json(func)
+            blocks = ir.block_map(f, ir.form_blocks(f.instrs))
+            ir.add_terminators(blocks)
+            in_, out = df_worklist(blocks, analysis(blocks), strategy,
+                                   stats, ir.edges)
+            total += stats['iterations']
+            for block in blocks:
+                print('{}:'.format(f.labels[block]))
+                print('  in: ', fmt(bit_names(in_[block], f.vars)))
+                print('  out:', fmt(bit_names(out[block], f.vars)))
+            continue
+
         # Form the CFG.
         blocks = cfg.block_map(form_blocks(func['instrs']))
         cfg.add_terminators(blocks)
 
-        in_, out = df_worklist(blocks, analysis)
+        if isinstance(analysis, Analysis):
+            in_, out = df_worklist(blocks, analysis, strategy, stats)
+        else:
+            bit_analysis, var_bits = analysis(blocks)
+            in_, out = df_worklist(blocks, bit_analysis, strategy, stats)
+            in_ = {b: var_bits.names_of(v) for b, v in in_.items()}
+            out = {b: var_bits.names_of(v) for b, v in out.items()}
+        total += stats['iterations']
         for block in blocks:
             print('{}:'.format(block))
             print('  in: ', fmt(in_[block]))
             print('  out:', fmt(out[block]))
 
+    # Report the total number of block visits, e.g., for `brench`.
+    if report:
+        print('df_iterations: {}'.format(total), file=sys.stderr)
+
 
 def gen(block):
     """Variables that are written in the block.
@@ -110,6 +229,121 @@ def use(block):
     return used
 
 
+class VarBits:
+    """Intern variable names into dense indices so sets of variables
+    can be represented as int bit-vectors.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+
+    def bits(self, names):
+        """Get the bit-vector for a set of variable names, assigning
+        indices to any names we haven't seen yet.
+        """
+        out = 0
+        for name in names:
+            if name not in self.index:
+                self.index[name] = len(self.names)
+                self.names.append(name)
+            out |= 1 << self.index[name]
+        return out
+
+    def names_of(self, bits):
+        """Convert a bit-vector back into a set of variable names.
+        """
+        out = set()
+        while bits:
+            low = bits & -bits
+            out.add(self.names[low.bit_length() - 1])
+            bits ^= low
+        return out
+
+
+def bit_union(vals):
+    out = 0
+    for v in vals:
+        out |= v
+    return out
+
+
+def gen_kill_analysis(blocks, forward, gen, kill):
+    """Build an `Analysis` over bit-vectors for a classic gen/kill
+    problem on the given blocks, where the transfer function is
+    `gen | (in & ~kill)`. `gen` and `kill` map blocks to sets of
+    variable names; they are computed once per block up front.
+
+    Return the analysis and the `VarBits` that maps its bit-vectors
+    back to names.
+    """
+    var_bits = VarBits()
+    gens = {}
+    keeps = {}
+    for block in blocks.values():
+        gens[id(block)] = var_bits.bits(gen(block))
+        keeps[id(block)] = ~var_bits.bits(kill(block))
+
+    def transfer(block, in_):
+        return gens[id(block)] | (in_ & keeps[id(block)])
+
+    return Analysis(forward, 0, bit_union, transfer), var_bits
+
+
+def gen_bits(block):
+    """Like `gen`, for a block of `ir.Instr`: the bit-vector of the
+    variable IDs written in the block.
+    """
+    out = 0
+    for i in block:
+        if i.dest is not None:
+            out |= 1 << i.dest
+    return out
+
+
+def use_bits(block):
+    """Like `use`, for a block of `ir.Instr`: the bit-vector of the
+    variable IDs read before they are written in the block.
+    """
+    defined = used = 0
+    for i in block:
+        if i.args:
+            for a in i.args:
+                if not defined >> a & 1:
+                    used |= 1 << a
+        if i.dest is not None:
+            defined |= 1 << i.dest
+    return used
+
+
+def bit_names(bits, names):
+    """Get the set of names for a bit-vector of IDs in `names`.
+    """
+    out = set()
+    while bits:
+        low = bits & -bits
+        out.add(names[low.bit_length() - 1])
+        bits ^= low
+    return out
+
+
+def ir_gen_kill_analysis(blocks, forward, gen, kill):
+    """Like `gen_kill_analysis`, for blocks of `ir.Instr`. Variable IDs
+    are the bit indices, so `gen` and `kill` produce bit-vectors
+    directly and there is no `VarBits`.
+    """
+    gens = {}
+    keeps = {}
+    for block in blocks.values():
+        gens[id(block)] = gen(block)
+        keeps[id(block)] = ~kill(block)
+
+    def transfer(block, in_):
+        return gens[id(block)] | (in_ & keeps[id(block)])
+
+    return Analysis(forward, 0, bit_union, transfer)
+
+
 def cprop_transfer(block, in_vals):
     out_vals = dict(in_vals)
     for instr in block:
@@ -164,6 +398,38 @@ ANALYSES = {
     ),
 }
 
+# Bit-vector versions of the set-based analyses above. These are built
+# per function because the bit assignment depends on its variables.
+BIT_ANALYSES = {
+    'defined': lambda blocks: gen_kill_analysis(
+        blocks, True, gen=gen, kill=lambda block: (),
+    ),
+    'live': lambda blocks: gen_kill_analysis(
+        blocks, False, gen=use, kill=gen,
+    ),
+}
+
+# The same analyses for the `ir` form of a function.
+IR_BIT_ANALYSES = {
+    'defined': lambda blocks: ir_gen_kill_analysis(
+        blocks, True, gen=gen_bits, kill=lambda block: 0,
+    ),
+    'live': lambda blocks: ir_gen_kill_analysis(
+        blocks, False, gen=use_bits, kill=gen_bits,
+    ),
+}
+
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    run_df(bril, ANALYSES[sys.argv[1]])
+    bril = load_bril()
+    strategy = 'rpo'
+    for arg in sys.argv[2:]:
+        if arg.startswith('--worklist='):
+            strategy = arg[len('--worklist='):]
+    use_ir = '--ir' in sys.argv[2:]
+    if use_ir:
+        analysis = IR_BIT_ANALYSES[sys.argv[1]]
+    elif '--bits' in sys.argv[2:]:
+        analysis = BIT_ANALYSES[sys.argv[1]]
+    else:
+        analysis = ANALYSES[sys.argv[1]]
+    run_df(bril, analysis, strategy, '--stats' in sys.argv[2:], use_ir)
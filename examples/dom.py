@@ -3,6 +3,7 @@ import sys
 
 from cfg import block_map, successors, add_terminators, add_entry
 from form_blocks import form_blocks
+from util import load_bril
 
 
 def map_inv(succ):
@@ -18,90 +19,143 @@ def map_inv(succ):
     return out
 
 
-def postorder_helper(succ, root, explored, out):
-    """Given a successor edge map, produce a list of all the nodes in
-    the graph in postorder by appending to the `out` list.
-    """
-    if root in explored:
-        return
-    explored.add(root)
-
-    for s in succ[root]:
-        postorder_helper(succ, s, explored, out)
-    out.append(root)
-
-
 def postorder(succ, root):
-    out = []
-    postorder_helper(succ, root, set(), out)
-    return out
+    """Given a successor edge map, produce a list of all the nodes
+    reachable from `root` in postorder.
 
-
-def intersect(sets):
-    sets = list(sets)
-    if not sets:
-        return set()
-    out = set(sets[0])
-    for s in sets[1:]:
-        out &= s
+    This uses an explicit stack instead of recursion so that it works
+    on very large graphs.
+    """
+    out = []
+    explored = {root}
+    stack = [(root, iter(succ[root]))]
+    while stack:
+        node, children = stack[-1]
+        for s in children:
+            if s not in explored:
+                explored.add(s)
+                stack.append((s, iter(succ[s])))
+                break
+        else:
+            stack.pop()
+            out.append(node)
     return out
 
 
-def get_dom(succ, entry):
-    pred = map_inv(succ)
-    nodes = list(reversed(postorder(succ, entry)))  # Reverse postorder.
+class Dominators:
+    """Dominance information for a CFG, computed with the iterative
+    algorithm from Cooper, Harvey, and Kennedy's "A Simple, Fast
+    Dominance Algorithm."
 
-    dom = {v: set(nodes) for v in succ}
-
-    while True:
-        changed = False
-
-        for node in nodes:
-            new_dom = intersect(dom[p] for p in pred[node])
-            new_dom.add(node)
-
-            if dom[node] != new_dom:
-                dom[node] = new_dom
-                changed = True
-
-        if not changed:
-            break
-
-    return dom
-
-
-def dom_fronts(dom, succ):
-    """Compute the dominance frontier, given the dominance relation.
+    The blocks reachable from the entry are numbered in reverse
+    postorder (`nodes` lists them and `index` maps names back to
+    numbers). The core result is `idom`, which maps each block's number
+    to the number of its immediate dominator; the entry is its own
+    immediate dominator. Everything else is derived from it on demand;
+    the tree and the frontiers are cached, so passes can share them.
+    Callers should not modify the returned maps. The entry should have
+    no predecessors (see `cfg.add_entry`).
     """
-    dom_inv = map_inv(dom)
-
-    frontiers = {}
-    for block in dom:
-        # Find all successors of dominated blocks.
-        dominated_succs = set()
-        for dominated in dom_inv[block]:
-            dominated_succs.update(succ[dominated])
 
-        # You're in the frontier if you're not strictly dominated by the
-        # current block.
-        frontiers[block] = [b for b in dominated_succs
-                            if b not in dom_inv[block] or b == block]
+    def __init__(self, succ, entry):
+        self.succ = succ
+        self.nodes = list(reversed(postorder(succ, entry)))
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+
+        self.preds = preds = [[] for _ in self.nodes]
+        for i, node in enumerate(self.nodes):
+            for s in succ[node]:
+                preds[self.index[s]].append(i)
+
+        idom = [None] * len(self.nodes)
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for i in range(1, len(self.nodes)):
+                new_idom = None
+                for p in preds[i]:
+                    if idom[p] is None:
+                        continue  # Not processed yet.
+                    if new_idom is None:
+                        new_idom = p
+                    else:
+                        new_idom = self._intersect(idom, p, new_idom)
+                if idom[i] != new_idom:
+                    idom[i] = new_idom
+                    changed = True
+        self.idom = idom
+        self._tree = None
+        self._fronts = None
+
+    @staticmethod
+    def _intersect(idom, a, b):
+        """Find the nearest common dominator of two blocks by walking up
+        the dominator tree from both.
+        """
+        while a != b:
+            while a > b:
+                a = idom[a]
+            while b > a:
+                b = idom[b]
+        return a
+
+    def dominates(self, a, b):
+        """Check whether block `a` dominates block `b`. Both must be
+        reachable from the entry.
+        """
+        i, j = self.index[a], self.index[b]
+        while j > i:
+            j = self.idom[j]
+        return i == j
+
+    def dom(self):
+        """Get a map from every block to the set of blocks that dominate
+        it. Unreachable blocks are (vacuously) dominated by every
+        reachable block.
+        """
+        sets = []
+        for i, node in enumerate(self.nodes):
+            sets.append(sets[self.idom[i]] | {node} if i else {node})
+        out = {v: set(self.nodes) for v in self.succ}
+        out.update(zip(self.nodes, sets))
+        return out
+
+    def tree(self):
+        """Get the dominator tree as a map from every block to the set
+        of blocks it immediately dominates.
+        """
+        if self._tree is None:
+            self._tree = {v: set() for v in self.succ}
+            for i in range(1, len(self.nodes)):
+                self._tree[self.nodes[self.idom[i]]].add(self.nodes[i])
+        return self._tree
+
+    def fronts(self):
+        """Get the dominance frontier of every block as a map to sets.
+
+        This is the "runner" algorithm: a join point is in the frontier
+        of every block on the dominator tree path from each of its
+        predecessors up to (but not including) its immediate dominator.
+        """
+        if self._fronts is None:
+            fronts = [set() for _ in self.nodes]
+            for i, preds in enumerate(self.preds):
+                if len(preds) < 2:
+                    continue
+                for runner in preds:
+                    while runner != self.idom[i]:
+                        fronts[runner].add(i)
+                        runner = self.idom[runner]
+
+            self._fronts = {v: set() for v in self.succ}
+            for i, front in enumerate(fronts):
+                self._fronts[self.nodes[i]] = {self.nodes[j] for j in front}
+        return self._fronts
 
-    return frontiers
 
-
-def dom_tree(dom):
-    # Get the blocks strictly dominated by a block strictly dominated by
-    # a given block.
-    dom_inv = map_inv(dom)
-    dom_inv_strict = {a: {b for b in bs if b != a}
-                      for a, bs in dom_inv.items()}
-    dom_inv_strict_2x = {a: set().union(*(dom_inv_strict[b] for b in bs))
-                         for a, bs in dom_inv_strict.items()}
-    return {
-        a: {b for b in bs if b not in dom_inv_strict_2x[a]}
-        for a, bs in dom_inv_strict.items()
-    }
+def get_dom(succ, entry):
+    return Dominators(succ, entry).dom()
 
 
 def print_dom(bril, mode):
@@ -110,14 +164,14 @@ def print_dom(bril, mode):
         add_entry(blocks)
         add_terminators(blocks)
         succ = {name: successors(block[-1]) for name, block in blocks.items()}
-        dom = get_dom(succ, list(blocks.keys())[0])
+        doms = Dominators(succ, list(blocks.keys())[0])
 
         if mode == 'front':
-            res = dom_fronts(dom, succ)
+            res = doms.fronts()
         elif mode == 'tree':
-            res = dom_tree(dom)
+            res = doms.tree()
         else:
-            res = dom
+            res = doms.dom()
 
         # Format as JSON for stable output.
         print(json.dumps(
@@ -128,6 +182,6 @@ def print_dom(bril, mode):
 
 if __name__ == '__main__':
     print_dom(
-        json.load(sys.stdin),
+        load_bril(),
         'dom' if len(sys.argv) < 2 else sys.argv[1]
     )
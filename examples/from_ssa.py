@@ -1,14 +1,22 @@
-import json
 import sys
+from collections import Counter
 
 from cfg import block_map, add_terminators, add_entry, reassemble
 from form_blocks import form_blocks
+from df import df_worklist, BIT_ANALYSES
+from analyses import AnalysisManager, CFG_SHAPE
+from util import Fresh, cached, fresh, jobs_arg, modify_funcs
 
 
-def func_from_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
+def func_from_ssa(func, am=None):
+    """Translate a function out of SSA form by putting copies for every
+    phi-node at the ends of its predecessors. The CFG comes from the
+    `AnalysisManager` `am`, if given; the `PRESERVES` analyses stay
+    valid.
+    """
+    if am is None:
+        am = AnalysisManager()
+    blocks = am.get(func, 'cfg')
 
     # Replace each phi-node.
     for block in blocks.values():
@@ -37,11 +45,267 @@ def func_from_ssa(func):
     func['instrs'] = reassemble(blocks)
 
 
-def from_ssa(bril):
+def sequentialize(copies, fresh_var):
+    """Turn a parallel copy into an equivalent sequence of copies.
+
+    `copies` is a list of `(dest, src, type)` triples that all happen at
+    once: every source is read before any destination is written. The
+    destinations must be distinct. `fresh_var` generates names for the
+    temporaries needed to break cycles (as in a swap). Return a list of
+    `id` instructions.
+    """
+    pending = {dest: src for dest, src, _ in copies if dest != src}
+    types = {dest: type for dest, _, type in copies}
+    readers = Counter(pending.values())
+    ready = [dest for dest in pending if not readers[dest]]
+    out = []
+    while pending:
+        # Emit copies whose destination no pending copy still needs.
+        while ready:
+            dest = ready.pop()
+            src = pending.pop(dest)
+            out.append({'op': 'id', 'type': types[dest], 'args': [src],
+                        'dest': dest})
+            readers[src] -= 1
+            if not readers[src] and src in pending:
+                ready.append(src)
+
+        # Everything left is a cycle. Save one destination's old value in
+        # a temporary; then that destination is free to be written.
+        if pending:
+            dest = next(iter(pending))
+            tmp = fresh_var()
+            out.append({'op': 'id', 'type': types[dest], 'args': [dest],
+                        'dest': tmp})
+            for d, s in pending.items():
+                if s == dest:
+                    pending[d] = tmp
+            readers[tmp] = readers.pop(dest)
+            ready.append(dest)
+    return out
+
+
+def phi_liveness(blocks, phis):
+    """Compute live variables for an SSA function, treating each phi-node
+    as a definition at the top of its block and each of its arguments as
+    a use at the end of the corresponding predecessor.
+
+    Return the live-in and live-out sets for every block along with the
+    "pseudo" blocks the analysis ran on.
+    """
+    end_uses = {name: [] for name in blocks}
+    for name in blocks:
+        for phi in phis[name]:
+            for label, arg in zip(phi['labels'], phi['args']):
+                if label in end_uses and arg != '__undefined':
+                    end_uses[label].append(arg)
+
+    pseudo = {}
+    for name, block in blocks.items():
+        body = [i for i in block if i.get('op') != 'phi']
+        pseudo[name] = (
+            [{'dest': phi['dest']} for phi in phis[name]] +
+            body[:-1] + [{'args': end_uses[name]}] + body[-1:]
+        )
+
+    analysis, var_bits = BIT_ANALYSES['live'](pseudo)
+    live_in, live_out = df_worklist(pseudo, analysis)
+    return (
+        {name: var_bits.names_of(v) for name, v in live_in.items()},
+        {name: var_bits.names_of(v) for name, v in live_out.items()},
+        pseudo,
+    )
+
+
+def interference(pseudo, live_out, phis, params):
+    """Build the interference graph for an SSA function as a map from
+    variables to sets of variables whose live ranges overlap.
+
+    `pseudo` and `live_out` come from `phi_liveness`.
+    """
+    graph = {}
+
+    def interfere(var, others):
+        for other in others:
+            if other != var:
+                graph.setdefault(var, set()).add(other)
+                graph.setdefault(other, set()).add(var)
+
+    for i, name in enumerate(pseudo):
+        live = set(live_out[name])
+        n_phis = len(phis[name])
+        for instr in reversed(pseudo[name][n_phis:]):
+            if 'dest' in instr:
+                interfere(instr['dest'], live)
+                live.discard(instr['dest'])
+            live.update(instr.get('args', []))
+
+        # Phi-nodes define their destinations simultaneously at the top
+        # of the block, as the parameters are defined before the entry.
+        dests = [phi['dest'] for phi in phis[name]]
+        if i == 0:
+            dests += params
+        for dest in dests:
+            interfere(dest, live)
+            interfere(dest, dests)
+
+    return graph
+
+
+def coalesce(phis, graph, params):
+    """Group the variables connected by phi-nodes into as few classes as
+    possible without putting interfering variables in one class.
+
+    Return a map from variables to the name that represents their class.
+    Parameters represent their own classes, so there is at most one per
+    class.
+    """
+    rep = {}
+    members = {}
+    nbrs = {}
+
+    def find(var):
+        if var not in rep:
+            rep[var] = var
+            members[var] = {var}
+            nbrs[var] = set(graph.get(var, ()))
+        while rep[var] != var:
+            rep[var] = rep[rep[var]]
+            var = rep[var]
+        return var
+
+    for block_phis in phis.values():
+        for phi in block_phis:
+            for arg in phi['args']:
+                if arg == '__undefined':
+                    continue
+                a, b = find(phi['dest']), find(arg)
+                if a == b or nbrs[a] & members[b]:
+                    continue
+                if b in params:
+                    if a in params:
+                        continue
+                    a, b = b, a
+                rep[b] = a
+                members[a] |= members.pop(b)
+                nbrs[a] |= nbrs.pop(b)
+
+    return {var: find(var) for var in list(rep)}
+
+
+def func_from_ssa_coalesce(func):
+    """Translate a function out of SSA form, coalescing the variables
+    connected by phi-nodes whenever their live ranges do not overlap.
+
+    The copies that remain on each control-flow edge form a parallel
+    copy, which is sequentialized so that swaps and lost copies are
+    handled correctly. The copies go at the end of the predecessor when
+    that is safe for the edge's other successors; otherwise the edge is
+    split.
+    """
+    blocks = block_map(form_blocks(func['instrs']))
+    add_entry(blocks)
+    add_terminators(blocks)
+    params = [a['name'] for a in func.get('args', [])]
+
+    phis = {name: [i for i in block if i.get('op') == 'phi']
+            for name, block in blocks.items()}
+    live_in, live_out, pseudo = phi_liveness(blocks, phis)
+    graph = interference(pseudo, live_out, phis, params)
+    names = coalesce(phis, graph, set(params))
+
+    # Rename every variable to its class and drop the phi-nodes.
+    for name, block in blocks.items():
+        new_block = []
+        for instr in block:
+            if instr.get('op') == 'phi':
+                continue
+            if 'dest' in instr:
+                instr['dest'] = names.get(instr['dest'], instr['dest'])
+            if 'args' in instr:
+                instr['args'] = [names.get(a, a) for a in instr['args']]
+            if instr.get('op') == 'id' and instr['args'] == [instr['dest']]:
+                continue  # Coalesced copy.
+            new_block.append(instr)
+        block[:] = new_block
+
+    # Gather the parallel copy for each edge.
+    edge_copies = {}
+    for name in blocks:
+        for phi in phis[name]:
+            dest = names.get(phi['dest'], phi['dest'])
+            for label, arg in zip(phi['labels'], phi['args']):
+                if arg == '__undefined' or label not in blocks:
+                    continue
+                edge_copies.setdefault((label, name), []).append(
+                    (dest, names.get(arg, arg), phi['type'])
+                )
+
+    # Names for temporaries.
+    var_names = set(graph) | set(names.values()) | set(params)
+    for block in blocks.values():
+        var_names.update(i['dest'] for i in block if 'dest' in i)
+
+    new_name = Fresh(var_names)
+
+    def fresh_var():
+        return new_name('ssa.tmp')
+
+    def live_on_edge(pred, succ):
+        """Get the (renamed) variables live along a control-flow edge.
+        """
+        out = {names.get(v, v) for v in live_in[succ]}
+        for phi in phis[succ]:
+            out.add(names.get(phi['dest'], phi['dest']))
+        return out
+
+    edge_seqs = {}
+    for edge, copies in edge_copies.items():
+        seq = sequentialize(copies, fresh_var)
+        if seq:
+            edge_seqs[edge] = seq
+    copy_succs = Counter(pred for pred, _ in edge_seqs)
+
+    # Place the copies at the end of the predecessor if no other edge out
+    # of it can observe them. Otherwise, put them in a new block on the
+    # edge.
+    for (pred, succ), seq in edge_seqs.items():
+        block = blocks[pred]
+        term = block[-1]
+        others = [s for s in term['labels'] if s != succ]
+        clobbered = {i['dest'] for i in seq}
+        if copy_succs[pred] == 1 and not clobbered & (
+            set(term.get('args', [])).union(*(live_on_edge(pred, s)
+                                              for s in others))
+        ):
+            block[-1:] = seq + [term]
+        else:
+            split = fresh('{}.{}'.format(pred, succ), blocks)
+            blocks[split] = seq + [{'op': 'jmp', 'labels': [succ]}]
+            term['labels'] = [split if lbl == succ else lbl
+                              for lbl in term['labels']]
+
+    func['instrs'] = reassemble(blocks)
+
+
+# The analyses that `func_from_ssa` keeps valid. The copies go into the
+# blocks of the `'cfg'` result, and the function is reassembled from it.
+# `func_from_ssa_coalesce` can split edges, so it preserves nothing.
+PRESERVES = CFG_SHAPE | {'cfg'}
+
+
+def from_ssa(bril, coalesce=False):
     for func in bril['functions']:
-        func_from_ssa(func)
+        if coalesce:
+            func_from_ssa_coalesce(func)
+        else:
+            func_from_ssa(func)
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(from_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    if '--coalesce' in sys.argv[1:]:
+        modify = cached(func_from_ssa_coalesce, ['from_ssa', 'coalesce'])
+    else:
+        modify = cached(func_from_ssa, ['from_ssa'])
+    modify_funcs(modify, jobs=jobs_arg(sys.argv[1:]))
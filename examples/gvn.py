@@ -0,0 +1,161 @@
+"""Global value numbering for Bril functions in SSA form (as produced by
+`to_ssa.py`).
+
+This extends local value numbering (`lvn.py`) to whole functions by
+walking the dominator tree with scoped hash tables: a computation is
+available in a block if a block that dominates it computed the same
+value, so the value table is kept for a block's subtree in the dominator
+tree and unwound afterward. Every variable is assigned exactly once in
+SSA form, so variables keep their value numbers everywhere. The flags
+are the same as `lvn.py`'s: `-p` propagates copies, `-c` canonicalizes
+commutative operations, and `-f` folds constants. Propagating copies can
+extend the live ranges of phi-node destinations, so use `from_ssa.py
+--coalesce` to translate the result out of SSA form.
+"""
+
+import sys
+
+from analyses import AnalysisManager, CFG_SHAPE
+from cfg import reassemble
+from lvn import Numbering, Value, _canonicalize, _fold, _lookup
+from util import cached, jobs_arg, modify_funcs
+
+# Operations whose results are not determined by their arguments: the
+# same `load` can read different values (after a `store`, even one in
+# another block), and every `alloc` and `call` is different.
+IMPURE_OPS = frozenset({'call', 'alloc', 'load'})
+
+
+def gvn_func(func, prop=False, canon=False, fold=False, am=None):
+    """Apply global value numbering to a function in SSA form. The CFG
+    and dominators come from the `AnalysisManager` `am`, if given; the
+    `PRESERVES` analyses stay valid.
+    """
+    lookup = _lookup if prop else lambda v2n, v: v2n.get(v)
+    canonicalize = _canonicalize if canon else lambda v: v
+    fold = _fold if fold else lambda n2c, v: None
+
+    if am is None:
+        am = AnalysisManager()
+    blocks = am.get(func, 'cfg')
+    if not blocks:
+        return
+    _, succs = am.get(func, 'edges')
+    doms = am.get(func, 'dominators')
+
+    # The value number of every variable, the canonical variable holding
+    # each numbered value, and the values of constants, as in
+    # `lvn.lvn_block`. Only `value2num` is scoped.
+    var2num = Numbering()
+    num2var = {}
+    num2const = {}
+    value2num = {}
+
+    def number(var):
+        # Function arguments (and the `__undefined` placeholder) are
+        # their own canonical source.
+        if var not in var2num:
+            num2var[var2num.add(var)] = var
+        return var2num[var]
+
+    def visit(name):
+        """Number the instructions in a block. Return the values added
+        to `value2num`, which are available only in the block's subtree.
+        """
+        added = []
+        for instr in blocks[name]:
+            if instr.get('op') == 'phi':
+                # The arguments are renamed at the ends of the
+                # predecessors, below.
+                num2var[var2num.add(instr['dest'])] = instr['dest']
+                continue
+
+            argnums = tuple(number(var) for var in instr.get('args', []))
+
+            val = None
+            if 'dest' in instr and 'args' in instr and \
+               instr['op'] not in IMPURE_OPS:
+                val = canonicalize(Value(instr['op'], argnums))
+
+                num = lookup(value2num, val)
+                if num is not None:
+                    var2num[instr['dest']] = num
+                    if num in num2const:
+                        instr.update({
+                            'op': 'const',
+                            'value': num2const[num],
+                        })
+                        del instr['args']
+                    else:
+                        instr.update({
+                            'op': 'id',
+                            'args': [num2var[num]],
+                        })
+                    continue
+
+            if 'dest' in instr:
+                newnum = var2num.add(instr['dest'])
+                num2var[newnum] = instr['dest']
+                if instr['op'] == 'const':
+                    num2const[newnum] = instr['value']
+
+                if val is not None:
+                    const = fold(num2const, val)
+                    if const is not None:
+                        num2const[newnum] = const
+                        instr.update({
+                            'op': 'const',
+                            'value': const,
+                        })
+                        del instr['args']
+                        continue
+                    value2num[val] = newnum
+                    added.append(val)
+
+            if 'args' in instr:
+                instr['args'] = [num2var[n] for n in argnums]
+
+        # Every argument that a successor's phi-node takes from this
+        # block is defined in a block that dominates it.
+        for succ in succs[name]:
+            for instr in blocks[succ]:
+                if instr.get('op') != 'phi':
+                    continue
+                instr['args'] = [
+                    num2var[number(arg)]
+                    if label == name and arg != '__undefined' else arg
+                    for label, arg in zip(instr['labels'], instr['args'])
+                ]
+        return added
+
+    # Walk the dominator tree in preorder, with an explicit stack so that
+    # deep trees work.
+    children = [[] for _ in doms.nodes]
+    for i in range(1, len(doms.nodes)):
+        children[doms.idom[i]].append(i)
+    stack = [(visit(doms.nodes[0]), iter(children[0]))]
+    while stack:
+        added, kids = stack[-1]
+        for kid in kids:
+            stack.append((visit(doms.nodes[kid]), iter(children[kid])))
+            break
+        else:
+            stack.pop()
+            for val in added:
+                del value2num[val]
+
+    func['instrs'] = reassemble(blocks)
+
+
+# The analyses that `gvn_func` keeps valid: like `lvn_func`, it changes
+# instructions in place in the blocks of the `'cfg'` result.
+PRESERVES = CFG_SHAPE | {'cfg'}
+
+
+if __name__ == '__main__':
+    flags = '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv
+
+    def modify(func):
+        gvn_func(func, *flags)
+    modify_funcs(cached(modify, ['gvn', flags]),
+                 jobs=jobs_arg(sys.argv[1:]))
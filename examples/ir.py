@@ -0,0 +1,328 @@
+"""A compact in-memory form of Bril functions for the example passes.
+
+Instead of JSON dicts, a function holds a list of `Instr` objects with
+fixed slots. Opcodes are small integers (indices into `OPS`), and each
+function interns its variable names and labels as dense integer IDs, so
+passes can index lists by variable instead of hashing strings, and
+label operands need no lookup. `from_json` and `to_json` convert
+without losing anything: keys that the IR has no slot for, such as
+source positions, are kept on the side.
+
+This module also has IR versions of the basic CFG utilities from
+`form_blocks` and `cfg`. Blocks are named by their label IDs.
+"""
+
+from collections import OrderedDict, namedtuple
+
+from util import Fresh
+
+# Opcode numbers. The terminators come first so that `op < LABEL` checks
+# for one; `LABEL` marks a label pseudo-instruction. Other opcodes get
+# numbers (with `op_num`) the first time they are seen.
+OPS = ['jmp', 'br', 'ret', None, 'const', 'id', 'call', 'phi', 'nop']
+JMP, BR, RET, LABEL, CONST, ID, CALL, PHI, NOP = range(len(OPS))
+OP_NUMS = {op: i for i, op in enumerate(OPS) if op is not None}
+
+# A function argument: a variable ID, its type, and a dict of any other
+# keys in its JSON form (or None).
+Arg = namedtuple('Arg', ['var', 'type', 'extra'])
+
+
+def op_num(op):
+    """Get the number for an opcode name, assigning one if it is new.
+    """
+    try:
+        return OP_NUMS[op]
+    except KeyError:
+        n = OP_NUMS[op] = len(OPS)
+        OPS.append(op)
+        return n
+
+
+class Names:
+    """Intern names as dense integer IDs. `ids` maps names to IDs and
+    assigns the next ID to any name it has not seen; `names` maps IDs
+    back to names.
+    """
+    __slots__ = ('names', 'ids')
+
+    def __init__(self):
+        self.names = []
+        self.ids = _Interner(self.names)
+
+    def id(self, name):
+        """Get the ID for a name, assigning one if it is new.
+        """
+        return self.ids[name]
+
+    def __getitem__(self, n):
+        return self.names[n]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class _Interner(dict):
+    __slots__ = ('names',)
+
+    def __init__(self, names):
+        self.names = names
+
+    def __missing__(self, name):
+        n = self[name] = len(self.names)
+        self.names.append(name)
+        return n
+
+
+class Instr:
+    """An instruction or a label. Fields that the instruction does not
+    have are None.
+
+    `dest` is a variable ID and `args` a list of them. `labels` is a
+    list of label IDs; a label pseudo-instruction (with `op == LABEL`)
+    holds its own label there. `funcs` (function names), `type`, and
+    `value` are as in JSON. `extra` is a dict of any other keys, or None.
+    """
+    __slots__ = ('op', 'dest', 'type', 'args', 'funcs', 'labels', 'value',
+                 'extra')
+
+    def __init__(self, op, dest=None, type=None, args=None, funcs=None,
+                 labels=None, value=None, extra=None):
+        self.op = op
+        self.dest = dest
+        self.type = type
+        self.args = args
+        self.funcs = funcs
+        self.labels = labels
+        self.value = value
+        self.extra = extra
+
+
+class Function:
+    """A function: its name, its arguments (a list of `Arg`, or None),
+    its return type (or None), its `Instr` list, the `Names` for its
+    variables and labels, and a dict of any other keys (or None).
+    """
+    __slots__ = ('name', 'args', 'type', 'instrs', 'vars', 'labels',
+                 'extra')
+
+    def __init__(self, name):
+        self.name = name
+        self.args = None
+        self.type = None
+        self.instrs = []
+        self.vars = Names()
+        self.labels = Names()
+        self.extra = None
+
+
+# The instruction keys that have slots. A key whose value is null does
+# not count, so that it survives the round trip.
+_INSTR_KEYS = {'op', 'label', 'dest', 'type', 'args', 'funcs', 'labels',
+               'value'}
+
+
+def _extra(d, keys):
+    extra = {k: v for k, v in d.items() if k not in keys or v is None}
+    return extra or None
+
+
+def from_json(func):
+    """Convert a JSON function to a `Function`.
+    """
+    out = Function(func['name'])
+    var = out.vars.ids
+    label = out.labels.ids
+    if 'args' in func:
+        out.args = [Arg(var[a['name']], a['type'],
+                        _extra(a, ('name', 'type')))
+                    for a in func['args']]
+    out.type = func.get('type')
+    out.extra = _extra(func, ('name', 'args', 'type', 'instrs'))
+
+    instrs = out.instrs
+    op_nums = OP_NUMS
+    keys = _INSTR_KEYS
+    for instr in func['instrs']:
+        get = instr.get
+        op = get('op')
+        if op is not None:
+            dest = get('dest')
+            args = get('args')
+            labels = get('labels')
+            i = Instr(
+                op_nums[op] if op in op_nums else op_num(op),
+                None if dest is None else var[dest],
+                get('type'),
+                None if args is None else [var[a] for a in args],
+                get('funcs'),
+                None if labels is None else [label[lbl] for lbl in labels],
+                get('value'),
+            )
+        else:
+            i = Instr(LABEL, labels=[label[instr['label']]])
+        if not keys.issuperset(instr) or None in instr.values():
+            i.extra = _extra(instr, keys)
+        instrs.append(i)
+    return out
+
+
+def to_json(func):
+    """Convert a `Function` back to a JSON function.
+    """
+    names = func.vars.names
+    label_names = func.labels.names
+    out = {'name': func.name}
+    if func.args is not None:
+        out['args'] = []
+        for a in func.args:
+            arg = {'name': names[a.var], 'type': a.type}
+            if a.extra:
+                arg.update(a.extra)
+            out['args'].append(arg)
+    if func.type is not None:
+        out['type'] = func.type
+
+    instrs = out['instrs'] = []
+    for i in func.instrs:
+        if i.op == LABEL:
+            instr = {'label': label_names[i.labels[0]]}
+        else:
+            instr = {'op': OPS[i.op]}
+            if i.dest is not None:
+                instr['dest'] = names[i.dest]
+            if i.type is not None:
+                instr['type'] = i.type
+            if i.args is not None:
+                instr['args'] = [names[a] for a in i.args]
+            if i.funcs is not None:
+                instr['funcs'] = i.funcs
+            if i.labels is not None:
+                instr['labels'] = [label_names[lbl] for lbl in i.labels]
+            if i.value is not None:
+                instr['value'] = i.value
+        if i.extra:
+            instr.update(i.extra)
+        instrs.append(instr)
+
+    if func.extra:
+        out.update(func.extra)
+    return out
+
+
+def on_json(modify):
+    """Turn a function that changes a `Function` in place into one that
+    changes a JSON function in place (for example, for
+    `util.modify_funcs`).
+    """
+    def modify_json(func):
+        f = from_json(func)
+        modify(f)
+        func.clear()
+        func.update(to_json(f))
+    return modify_json
+
+
+# CFG utilities.
+
+def form_blocks(instrs):
+    """Like `form_blocks.form_blocks`, for a list of `Instr`.
+    """
+    cur_block = []
+    for instr in instrs:
+        if instr.op != LABEL:
+            cur_block.append(instr)
+            if instr.op < LABEL:
+                yield cur_block
+                cur_block = []
+        else:
+            if cur_block:
+                yield cur_block
+            cur_block = [instr]
+    if cur_block:
+        yield cur_block
+
+
+def block_map(func, blocks):
+    """Like `cfg.block_map`: map label IDs to blocks, without their
+    labels. Anonymous blocks get fresh labels in `func`.
+    """
+    by_name = OrderedDict()
+    blocks = list(blocks)
+    fresh = Fresh({func.labels[b[0].labels[0]] for b in blocks
+                   if b[0].op == LABEL})
+    for block in blocks:
+        if block[0].op == LABEL:
+            name = block[0].labels[0]
+            block = block[1:]
+        else:
+            name = func.labels.id(fresh('b'))
+        by_name[name] = block
+    return by_name
+
+
+def successors(instr):
+    """Get the label IDs that a terminator can jump to.
+    """
+    if instr.op == JMP or instr.op == BR:
+        return instr.labels
+    elif instr.op == RET:
+        return []
+    else:
+        raise ValueError('{} is not a terminator'.format(OPS[instr.op]))
+
+
+def add_terminators(blocks):
+    """Like `cfg.add_terminators`.
+    """
+    names = list(blocks)
+    for i, block in enumerate(blocks.values()):
+        if not block or block[-1].op >= LABEL:
+            if i == len(names) - 1:
+                block.append(Instr(RET, args=[]))
+            else:
+                block.append(Instr(JMP, labels=[names[i + 1]]))
+
+
+def add_entry(func, blocks):
+    """Like `cfg.add_entry`. The new entry block gets a fresh label in
+    `func`.
+    """
+    first = next(iter(blocks))
+    for block in blocks.values():
+        for instr in block:
+            if instr.labels is not None and first in instr.labels and \
+               instr.op != PHI:
+                break
+        else:
+            continue
+        break
+    else:
+        return
+
+    names = {func.labels[b] for b in blocks}
+    new = func.labels.id(Fresh(names)('entry'))
+    blocks[new] = []
+    blocks.move_to_end(new, last=False)
+
+
+def edges(blocks):
+    """Like `cfg.edges`: get the predecessor and successor maps.
+    """
+    preds = {name: [] for name in blocks}
+    succs = {}
+    for name, block in blocks.items():
+        succs[name] = ss = successors(block[-1])
+        for s in ss:
+            preds[s].append(name)
+    return preds, succs
+
+
+def reassemble(blocks):
+    """Like `cfg.reassemble`: flatten a block map into an `Instr` list.
+    """
+    instrs = []
+    for name, block in blocks.items():
+        instrs.append(Instr(LABEL, labels=[name]))
+        instrs += block
+    return instrs
@@ -0,0 +1,273 @@
+"""Induction variable analysis and strength reduction for Bril functions
+in SSA form (as produced by `to_ssa.py`).
+
+A *basic* induction variable of a loop is an integer phi-node in the
+loop's header that starts with a value from outside the loop and has the
+same loop-invariant step added on every back edge. A *derived* one is
+computed from another induction variable and loop-invariant values with
+`id`, `add`, `sub`, `mul`, or `ptradd`, so it also changes by a
+loop-invariant step on every iteration.
+
+For every loop, innermost first, this pass:
+
+- Eliminates redundant basic induction variables: one with the same step
+  as another is the other plus the difference of their initial values.
+- Strength-reduces the derived induction variables computed with `mul`,
+  or with `ptradd` from another derived one (directly or through other
+  derived ones): each becomes a phi-node in the header that starts with
+  its value for the initial values and is incremented by its step (with
+  `add`, or `ptradd` for pointers) on every back edge. The loop then uses
+  it instead. (A `ptradd` from a basic induction variable is left alone:
+  replacing it would trade one `ptradd` for another.)
+- Deletes basic induction variables that are then only used to compute
+  their own next values.
+
+Initial values and steps are computed in the loop's preheader (see
+`loops.add_preheaders`). Only values defined outside the loop are
+loop-invariant, so run `licm.py` first, and follow this pass with
+`tdce.py` to delete the computations it leaves unused.
+"""
+
+import sys
+from collections import Counter
+
+from cfg import CFG, reassemble
+from loops import preheader_loops
+from util import Fresh, cached, jobs_arg, modify_funcs
+
+# The operations that derive induction variables.
+DERIVING_OPS = frozenset({'id', 'add', 'sub', 'mul', 'ptradd'})
+
+
+def _is_ptr(type):
+    return isinstance(type, dict) and 'ptr' in type
+
+
+def basic_ivs(blocks, loop, pre, defined):
+    """Find the basic induction variables of a loop with the preheader
+    `pre`, given the variables defined in the loop. Return a map from
+    each one to its initial value, its step, and the variable holding
+    its next value.
+    """
+    latches = set(loop.latches)
+    defs = {instr['dest']: instr for name in loop.body
+            for instr in blocks[name] if 'dest' in instr}
+    out = {}
+    for instr in blocks[loop.header]:
+        if instr.get('op') != 'phi' or instr['type'] != 'int' or \
+           set(instr['labels']) != latches | {pre}:
+            continue
+        pairs = dict(zip(instr['labels'], instr['args']))
+        init = pairs.pop(pre)
+        nexts = set(pairs.values())
+        if init in defined or init == '__undefined' or len(nexts) != 1:
+            continue
+
+        # The value on every back edge must add a step to this one.
+        next_var = nexts.pop()
+        update = defs.get(next_var)
+        if update is None or update['op'] != 'add':
+            continue
+        args = list(update['args'])
+        if args.count(instr['dest']) != 1:
+            continue
+        args.remove(instr['dest'])
+        if args[0] not in defined:
+            out[instr['dest']] = (init, args[0], next_var)
+    return out
+
+
+def derived_ivs(blocks, body, ivs, defined):
+    """Find the derived induction variables among the instructions in
+    the blocks `body` (in dominance order), given the known induction
+    variables and the variables defined in the loop. Return a map from
+    each one to the induction variable it is derived from and its
+    defining instruction.
+    """
+    out = {}
+    for name in body:
+        for instr in blocks[name]:
+            op = instr.get('op')
+            if op not in DERIVING_OPS or instr['dest'] in ivs:
+                continue
+            args = instr['args']
+            if op == 'id':
+                iv_args = [0] if args[0] in ivs else []
+            elif op == 'sub':
+                # The step of `sub x y` does not depend on y only if x
+                # is the induction variable.
+                iv_args = [0] if args[0] in ivs else []
+            else:
+                iv_args = [i for i, a in enumerate(args) if a in ivs]
+            if len(iv_args) != 1 or any(
+                a in defined or a == '__undefined'
+                for i, a in enumerate(args) if i != iv_args[0]
+            ):
+                continue
+            ivs[instr['dest']] = args[iv_args[0]]
+            out[instr['dest']] = (args[iv_args[0]], instr)
+    return out
+
+
+def reduce_loop(blocks, loop, pre, body, fresh, consts):
+    """Eliminate redundant basic induction variables and strength-reduce
+    derived ones in a loop with the preheader `pre`. `body` lists the
+    loop's blocks in dominance order, `fresh` generates new names, and
+    `consts` maps variables to their constant values.
+    """
+    header = blocks[loop.header]
+    defined = {instr['dest'] for name in body for instr in blocks[name]
+               if 'dest' in instr}
+    basic = basic_ivs(blocks, loop, pre, defined)
+    code = []  # New instructions for the end of the preheader.
+
+    def emit(op, type, args):
+        dest = fresh('iv.')
+        code.append({'op': op, 'dest': dest, 'type': type, 'args': args})
+        return dest
+
+    # Basic induction variables with the same step are redundant. Keep
+    # the one that the most other instructions in the loop use (such as
+    # the loop's condition), and replace the others' phi-nodes with
+    # additions to it.
+    init = {var: start for var, (start, _, _) in basic.items()}
+    uses = {var: 0 for var in basic}
+    for name in body:
+        for instr in blocks[name]:
+            if instr.get('op') not in DERIVING_OPS:
+                for arg in instr.get('args', []):
+                    if arg in uses:
+                        uses[arg] += 1
+    by_step = {}
+    for var, (start, step, _) in basic.items():
+        by_step.setdefault(step, []).append(var)
+    for step, group in by_step.items():
+        first = max(group, key=uses.__getitem__)
+        for var in group:
+            if var == first:
+                continue
+            diff = emit('sub', 'int', [init[var], init[first]])
+            phi = next(i for i in header if i.get('dest') == var)
+            header.remove(phi)
+            n_phis = sum(1 for i in header if i.get('op') == 'phi')
+            header.insert(n_phis, {'op': 'add', 'dest': var, 'type': 'int',
+                                   'args': [first, diff]})
+            del basic[var]
+
+    ivs = {var: var for var in basic}
+    derived = derived_ivs(blocks, body, ivs, defined)
+    steps = {var: step for var, (_, step, _) in basic.items()}
+
+    def get_init(var):
+        # The value of an induction variable for the initial values of
+        # the basic ones.
+        if var not in init:
+            _, instr = derived[var]
+            args = [get_init(a) if a in ivs else a for a in instr['args']]
+            if instr['op'] == 'id':
+                init[var] = args[0]
+            else:
+                init[var] = emit(instr['op'], instr['type'], args)
+        return init[var]
+
+    def get_step(var):
+        if var not in steps:
+            iv, instr = derived[var]
+            if instr['op'] == 'mul':
+                factor = next(a for a in instr['args'] if a != iv)
+                step = get_step(iv)
+                steps[var] = factor if consts.get(step) == 1 else \
+                    emit('mul', 'int', [step, factor])
+            else:
+                steps[var] = get_step(iv)
+        return steps[var]
+
+    # Reduce the derived induction variables whose computation involves
+    # a `mul` or a `ptradd` from a derived induction variable, and that
+    # something other than another derived induction variable uses.
+    costly = {}
+    for var, (iv, instr) in derived.items():
+        costly[var] = instr['op'] == 'mul' or costly.get(iv, False) or \
+            instr['op'] == 'ptradd' and iv in derived
+    needed = set()
+    for name, block in blocks.items():
+        for instr in block:
+            if name in loop.body and instr.get('dest') in derived:
+                continue
+            needed.update(instr.get('args', []))
+
+    renames = {}
+    for var, (iv, instr) in derived.items():
+        if not costly[var] or var not in needed:
+            continue
+        new = fresh(var + '.')
+        phi = {'op': 'phi', 'dest': new, 'type': instr['type'],
+               'labels': [pre], 'args': [get_init(var)]}
+        op = 'ptradd' if _is_ptr(instr['type']) else 'add'
+        for latch in sorted(set(loop.latches)):
+            update = fresh(new + '.')
+            blocks[latch].insert(-1, {'op': op, 'dest': update,
+                                      'type': instr['type'],
+                                      'args': [new, get_step(var)]})
+            phi['labels'].append(latch)
+            phi['args'].append(update)
+        header.insert(0, phi)
+        instr.update({'op': 'id', 'args': [new]})
+        renames[var] = new
+
+    # The new variables hold the same values as the ones they replace
+    # everywhere in the loop. (Uses after the loop still need the old
+    # ones, which might be from the previous iteration.)
+    for name in body:
+        for instr in blocks[name]:
+            if 'args' in instr and instr.get('dest') not in renames:
+                instr['args'] = [renames.get(a, a) for a in instr['args']]
+
+    block = blocks[pre]
+    block[-1:] = code + block[-1:]
+
+    # Delete the basic induction variables that are only used to compute
+    # their next values. (The phi-node and the update use each other, so
+    # `tdce` would keep them.)
+    used = Counter(arg for block in blocks.values() for instr in block
+                   for arg in instr.get('args', []))
+    for var, (_, _, next_var) in basic.items():
+        phi = next(i for i in header if i.get('dest') == var)
+        if used[var] == 1 and used[next_var] == phi['args'].count(next_var):
+            header.remove(phi)
+            for name in body:
+                blocks[name][:] = [i for i in blocks[name]
+                                   if i.get('dest') != next_var]
+
+
+def ivs_func(func):
+    """Eliminate redundant induction variables and strength-reduce
+    derived ones in every loop of a function in SSA form.
+    """
+    blocks = CFG(func['instrs']).block_map()
+    if not blocks:
+        return
+    doms, loops, preheaders = preheader_loops(blocks)
+    if not loops:
+        return
+
+    names = set(blocks) | {a['name'] for a in func.get('args', [])}
+    for block in blocks.values():
+        names.update(i['dest'] for i in block if 'dest' in i)
+    fresh = Fresh(names)
+    consts = {i['dest']: i['value'] for block in blocks.values()
+              for i in block if i.get('op') == 'const'}
+
+    for loop in reversed(loops):  # Innermost first.
+        body = sorted(loop.body, key=doms.index.__getitem__)
+        reduce_loop(blocks, loop, preheaders[loop.header], body, fresh,
+                    consts)
+    func['instrs'] = reassemble(blocks)
+
+
+# `ivs_func` can add blocks, so it keeps no analyses valid.
+PRESERVES = frozenset()
+
+
+if __name__ == '__main__':
+    modify_funcs(cached(ivs_func, ['ivs']), jobs=jobs_arg(sys.argv[1:]))
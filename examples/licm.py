@@ -0,0 +1,120 @@
+"""Loop-invariant code motion for Bril functions in SSA form (as
+produced by `to_ssa.py`).
+
+Every natural loop gets a preheader (see `loops.add_preheaders`), and
+the pure instructions in the loop whose arguments are all defined
+outside the loop (or by other such instructions) move to the end of the
+preheader, so they run once each time the loop is entered instead of on
+every iteration. Inner loops go first, so an instruction can move out of
+several loops at once. In SSA form, every variable has one definition,
+which dominates its uses, so the moved definition still does.
+
+With `--report`, print the loop nest of every function to stderr, with
+the number of instructions moved out of each loop.
+"""
+
+import sys
+
+from cfg import CFG, reassemble
+from loops import preheader_loops
+from util import cached, jobs_arg, modify_funcs
+
+# Operations that can be executed speculatively: they have no side
+# effects and cannot fail. (`div` can, when dividing by zero; see
+# `_invariant`.)
+PURE_OPS = frozenset({
+    'const', 'id', 'add', 'sub', 'mul', 'eq', 'lt', 'gt', 'le', 'ge',
+    'not', 'and', 'or', 'fadd', 'fsub', 'fmul', 'fdiv', 'feq', 'flt',
+    'fgt', 'fle', 'fge', 'ceq', 'clt', 'cgt', 'cle', 'cge', 'char2int',
+    'ptradd',
+})
+
+
+def _invariant(instr, defined, consts):
+    """Check whether an instruction can move out of a loop, given the
+    variables defined in the loop by instructions that cannot and the
+    constant values of variables.
+    """
+    op = instr.get('op')
+    if 'dest' not in instr or \
+       any(arg in defined for arg in instr.get('args', [])):
+        return False
+    if op == 'div':
+        # Only division by a nonzero constant is sure to succeed.
+        return consts.get(instr['args'][1], 0) != 0
+    return op in PURE_OPS
+
+
+def licm_func(func, report=None):
+    """Move loop-invariant code out of the loops in a function in SSA
+    form. If `report` is a list, add lines describing the loop nest and
+    the number of instructions moved out of each loop.
+    """
+    blocks = CFG(func['instrs']).block_map()
+    if not blocks:
+        return
+    doms, loops, preheaders = preheader_loops(blocks)
+    if not loops:
+        if report is not None:
+            report.append('{}:'.format(func['name']))
+        return
+
+    consts = {}
+    for block in blocks.values():
+        for instr in block:
+            if instr.get('op') == 'const':
+                consts[instr['dest']] = instr['value']
+
+    hoisted = {}
+    for loop in reversed(loops):  # Innermost first.
+        body = sorted(loop.body, key=doms.index.__getitem__)
+        defined = {instr['dest'] for b in body for instr in blocks[b]
+                   if 'dest' in instr}
+        moved = []
+
+        # A phi-node in the header that only merges one value from outside
+        # the loop with itself (for a variable that the loop never
+        # changes) is a copy of that value.
+        for instr in blocks[loop.header]:
+            if instr.get('op') == 'phi':
+                args = set(instr['args']) - {instr['dest']}
+                if len(args) == 1 and not args & (defined | {'__undefined'}):
+                    instr.update({'op': 'id', 'args': list(args)})
+                    del instr['labels']
+
+        for b in body:
+            kept = []
+            for instr in blocks[b]:
+                if _invariant(instr, defined, consts):
+                    moved.append(instr)
+                    defined.discard(instr['dest'])
+                else:
+                    kept.append(instr)
+            blocks[b][:] = kept
+        pre = blocks[preheaders[loop.header]]
+        pre[-1:] = moved + pre[-1:]
+        hoisted[loop.header] = len(moved)
+
+    if report is not None:
+        report.append('{}:'.format(func['name']))
+        for loop in loops:
+            report.append('{}{}: {} hoisted'.format(
+                '  ' * loop.depth, loop.header, hoisted[loop.header],
+            ))
+    func['instrs'] = reassemble(blocks)
+
+
+# `licm_func` adds blocks, so it keeps no analyses valid.
+PRESERVES = frozenset()
+
+
+if __name__ == '__main__':
+    if '--report' in sys.argv[1:]:
+        # The report needs every function in this process.
+        report = []
+        modify_funcs(lambda func: licm_func(func, report))
+        for line in report:
+            print(line, file=sys.stderr)
+    else:
+        modify_funcs(cached(licm_func, ['licm']),
+                     jobs=jobs_arg(sys.argv[1:]))
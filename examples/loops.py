@@ -0,0 +1,173 @@
+"""Find the natural loops in Bril functions and print the loop nest.
+"""
+
+from cfg import block_map, successors, add_terminators, add_entry, edges
+from dom import Dominators, map_inv
+from form_blocks import form_blocks
+from util import Fresh, load_bril
+
+
+class Loop:
+    """A natural loop: its `header` block, the set of blocks in its
+    `body` (including the header), and the `latches` whose edges back to
+    the header make it a loop. `parent` is the innermost loop that
+    contains this one (or None), `children` are the loops directly
+    inside it, and `depth` is 1 for an outermost loop.
+    """
+
+    def __init__(self, header, body, latches):
+        self.header = header
+        self.body = body
+        self.latches = latches
+        self.parent = None
+        self.children = []
+        self.depth = 1
+
+
+def natural_loops(succ, doms):
+    """Find the natural loops in a CFG, given its successor map and its
+    `Dominators`.
+
+    An edge is a back edge if its target dominates its source. Back edges
+    to the same header make up a single loop. The loops come outermost
+    first (each loop comes after every loop that contains it).
+    """
+    preds = map_inv(succ)
+    latches = {}
+    for node in doms.nodes:
+        for s in succ[node]:
+            if doms.dominates(s, node):
+                latches.setdefault(s, []).append(node)
+
+    loops = []
+    for header, tails in latches.items():
+        # Walk backward from the latches; the header stops the walk.
+        body = {header}
+        stack = [t for t in tails if t != header]
+        while stack:
+            node = stack.pop()
+            if node not in body and node in doms.index:
+                body.add(node)
+                stack.extend(preds[node])
+        loops.append(Loop(header, body, tails))
+
+    # Sort by size so that every loop comes after the loops containing it,
+    # and find each loop's innermost container among those.
+    loops.sort(key=lambda loop: (-len(loop.body), doms.index[loop.header]))
+    for i, loop in enumerate(loops):
+        for outer in reversed(loops[:i]):
+            if loop.header in outer.body:
+                loop.parent = outer
+                loop.depth = outer.depth + 1
+                outer.children.append(loop)
+                break
+    return loops
+
+
+def add_preheaders(blocks, loops):
+    """Give every loop in a block map a preheader: a block outside the
+    loop whose only successor is the header, and which is the header's
+    only predecessor from outside the loop. Return a map from headers to
+    their preheaders.
+
+    A predecessor that already fits is used as it is. Otherwise, a new
+    block goes just before the header, and the edges into the loop are
+    redirected to it. Phi-node arguments from outside the loop move to
+    the preheader: if they differ, a new phi-node there merges them.
+    """
+    preds, succs = edges(blocks)
+    names = set(blocks)
+    for block in blocks.values():
+        names.update(i['dest'] for i in block if 'dest' in i)
+    fresh = Fresh(names)
+
+    preheaders = {}
+    new_blocks = {}
+    for loop in loops:
+        header = loop.header
+        outside = [p for p in preds[header] if p not in loop.body]
+        if len(outside) == 1 and succs[outside[0]] == [header]:
+            preheaders[header] = outside[0]
+            continue
+
+        pre = fresh('{}.preheader'.format(header))
+        new_block = []
+        for instr in blocks[header]:
+            if instr.get('op') != 'phi':
+                continue
+            pairs = [(label, arg) for label, arg
+                     in zip(instr['labels'], instr['args'])
+                     if label not in outside]
+            outer = [arg for label, arg
+                     in zip(instr['labels'], instr['args'])
+                     if label in outside]
+            if len(set(outer)) > 1:
+                var = fresh(instr['dest'] + '.')
+                new_block.append({
+                    'op': 'phi', 'dest': var, 'type': instr['type'],
+                    'labels': [label for label in instr['labels']
+                               if label in outside],
+                    'args': outer,
+                })
+                outer = [var]
+            if outer:
+                pairs.append((pre, outer[0]))
+            instr['labels'] = [label for label, _ in pairs]
+            instr['args'] = [arg for _, arg in pairs]
+        new_block.append({'op': 'jmp', 'labels': [header]})
+
+        for p in outside:
+            term = blocks[p][-1]
+            term['labels'] = [pre if label == header else label
+                              for label in term['labels']]
+        preheaders[header] = pre
+        new_blocks[header] = (pre, new_block)
+
+    # Put each new preheader just before its header.
+    order = list(blocks.items())
+    blocks.clear()
+    for name, block in order:
+        if name in new_blocks:
+            pre, pre_block = new_blocks[name]
+            blocks[pre] = pre_block
+        blocks[name] = block
+    return preheaders
+
+
+def preheader_loops(blocks):
+    """Find the natural loops in a block map (with an entry block and
+    terminators) and give them preheaders with `add_preheaders`. Return
+    the `Dominators` and the loops of the resulting CFG, in which the
+    bodies of outer loops include the preheaders of inner ones, and the
+    map from headers to preheaders. If there are no loops, the blocks
+    are left alone.
+    """
+    _, succs = edges(blocks)
+    doms = Dominators(succs, next(iter(blocks)))
+    loops = natural_loops(succs, doms)
+    if not loops:
+        return doms, loops, {}
+    preheaders = add_preheaders(blocks, loops)
+    _, succs = edges(blocks)
+    doms = Dominators(succs, next(iter(blocks)))
+    return doms, natural_loops(succs, doms), preheaders
+
+
+def print_loops(bril):
+    for func in bril['functions']:
+        blocks = block_map(form_blocks(func['instrs']))
+        add_entry(blocks)
+        add_terminators(blocks)
+        succ = {name: successors(block[-1]) for name, block in blocks.items()}
+        doms = Dominators(succ, next(iter(blocks)))
+
+        print('{}:'.format(func['name']))
+        for loop in natural_loops(succ, doms):
+            print('{}{}: {}'.format(
+                '  ' * loop.depth, loop.header,
+                ' '.join(b for b in blocks if b in loop.body),
+            ))
+
+
+if __name__ == '__main__':
+    print_loops(load_bril())
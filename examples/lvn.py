@@ -1,11 +1,13 @@
 """Local value numbering for Bril.
 """
-import json
 import sys
 from collections import namedtuple
 
+from analyses import CFG_SHAPE
+import ir
 from form_blocks import form_blocks
-from util import flatten
+from sccp import FOLDABLE_OPS
+from util import cached, flatten, jobs_arg, modify_funcs
 
 # A Value uniquely represents a computation in terms of sub-values.
 Value = namedtuple('Value', ['op', 'args'])
@@ -179,6 +181,84 @@ def lvn_block(block, lookup, canonicalize, fold):
             instr['args'] = [num2var[n] for n in argnums]
 
 
+def lvn_block_ir(block, func, lookup, canonicalize, fold):
+    """Like `lvn_block`, for a block of `ir.Instr` in `func`. `Value`s
+    still use opcode names, so the same `lookup`, `canonicalize`, and
+    `fold` functions work for both.
+    """
+    var2num = Numbering()
+    value2num = {}
+    num2var = {}
+    num2const = {}
+    var_id = func.vars.ids.__getitem__
+    OPS = ir.OPS
+
+    # Find the variables read before they are written and the last
+    # write of each variable.
+    written = set()
+    for instr in block:
+        if instr.args is not None:
+            for var in instr.args:
+                if var not in written and var not in var2num:
+                    num2var[var2num.add(var)] = var
+        if instr.dest is not None:
+            written.add(instr.dest)
+    last_write = [False] * len(block)
+    seen = set()
+    for idx in range(len(block) - 1, -1, -1):
+        dest = block[idx].dest
+        if dest is not None and dest not in seen:
+            last_write[idx] = True
+            seen.add(dest)
+
+    for idx, instr in enumerate(block):
+        dest = instr.dest
+        argnums = () if instr.args is None else \
+            tuple([var2num[var] for var in instr.args])
+
+        val = None
+        if dest is not None and instr.args is not None and \
+           instr.op != ir.CALL:
+            val = canonicalize(Value(OPS[instr.op], argnums))
+
+            num = lookup(value2num, val)
+            if num is not None:
+                var2num[dest] = num
+                if num in num2const:
+                    instr.op = ir.CONST
+                    instr.value = num2const[num]
+                    instr.args = None
+                else:
+                    instr.op = ir.ID
+                    instr.args = [num2var[num]]
+                continue
+
+        if dest is not None:
+            newnum = var2num.add(dest)
+            if instr.op == ir.CONST:
+                num2const[newnum] = instr.value
+
+            if last_write[idx]:
+                var = dest
+            else:
+                var = var_id('lvn.{}'.format(newnum))
+            num2var[newnum] = var
+            instr.dest = var
+
+            if val is not None:
+                const = fold(num2const, val)
+                if const is not None:
+                    num2const[newnum] = const
+                    instr.op = ir.CONST
+                    instr.value = const
+                    instr.args = None
+                    continue
+                value2num[val] = newnum
+
+        if instr.args is not None:
+            instr.args = [num2var[n] for n in argnums]
+
+
 def _lookup(value2num, value):
     """Value lookup function with propagation through `id` values.
     """
@@ -188,23 +268,6 @@ def _lookup(value2num, value):
         return value2num.get(value)
 
 
-FOLDABLE_OPS = {
-    'add': lambda a, b: a + b,
-    'mul': lambda a, b: a * b,
-    'sub': lambda a, b: a - b,
-    'div': lambda a, b: a // b,
-    'gt': lambda a, b: a > b,
-    'lt': lambda a, b: a < b,
-    'ge': lambda a, b: a >= b,
-    'le': lambda a, b: a <= b,
-    'ne': lambda a, b: a != b,
-    'eq': lambda a, b: a == b,
-    'or': lambda a, b: a or b,
-    'and': lambda a, b: a and b,
-    'not': lambda a: not a
-}
-
-
 def _fold(num2const, value):
     if value.op in FOLDABLE_OPS:
         try:
@@ -246,23 +309,55 @@ def _canonicalize(value):
         return value
 
 
+def lvn_func(func, prop=False, canon=False, fold=False):
+    """Apply the local value numbering optimization to every basic block
+    in a function.
+    """
+    blocks = list(form_blocks(func['instrs']))
+    for block in blocks:
+        lvn_block(
+            block,
+            lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+            canonicalize=_canonicalize if canon else lambda v: v,
+            fold=_fold if fold else lambda n2c, v: None,
+        )
+    func['instrs'] = flatten(blocks)
+
+
+def lvn_func_ir(func, prop=False, canon=False, fold=False):
+    """Like `lvn_func`, for an `ir.Function`.
+    """
+    blocks = list(ir.form_blocks(func.instrs))
+    for block in blocks:
+        lvn_block_ir(
+            block, func,
+            lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
+            canonicalize=_canonicalize if canon else lambda v: v,
+            fold=_fold if fold else lambda n2c, v: None,
+        )
+    func.instrs = flatten(blocks)
+
+
+# The analyses that `lvn_func` keeps valid: it changes instructions in
+# place, but never adds, removes, or reorders them or changes a label.
+PRESERVES = CFG_SHAPE | {'cfg'}
+
+
 def lvn(bril, prop=False, canon=False, fold=False):
     """Apply the local value numbering optimization to every basic block
     in every function.
     """
     for func in bril['functions']:
-        blocks = list(form_blocks(func['instrs']))
-        for block in blocks:
-            lvn_block(
-                block,
-                lookup=_lookup if prop else lambda v2n, v: v2n.get(v),
-                canonicalize=_canonicalize if canon else lambda v: v,
-                fold=_fold if fold else lambda n2c, v: None,
-            )
-        func['instrs'] = flatten(blocks)
+        lvn_func(func, prop, canon, fold)
 
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
-    lvn(bril, '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    flags = '-p' in sys.argv, '-c' in sys.argv, '-f' in sys.argv
+    use_ir = '--ir' in sys.argv
+    if use_ir:
+        modify = ir.on_json(lambda func: lvn_func_ir(func, *flags))
+    else:
+        def modify(func):
+            lvn_func(func, *flags)
+    modify_funcs(cached(modify, ['lvn', flags, use_ir]),
+                 jobs=jobs_arg(sys.argv[1:]))
@@ -0,0 +1,237 @@
+"""Run a pipeline of the example passes on a program in one process.
+
+    python3 opt.py --passes=to_ssa,lvn,tdce+,from_ssa < prog.json
+
+does the same thing as piping the program through `to_ssa.py`, `lvn.py`,
+`tdce.py tdce+`, and `from_ssa.py`, but the program is only parsed and
+printed once, and the passes share an `AnalysisManager`, so an analysis
+that one pass preserves is not recomputed by the next. Each function goes
+through the whole pipeline before the next one is read.
+
+A pass is a name in `PASSES`, optionally followed by options separated by
+colons. The options are the pass's command-line flags without their
+dashes: for example, `lvn:p:c:f` or `to_ssa:pruned`. With `--time`, print
+the time spent in each pass to stderr. With `--verify`, check every
+function before the first pass and after each pass (see `verify_func`),
+and stop at the first pass that breaks one. With `-j N`, run the pipeline
+on N functions at once in worker processes. Without `--time` or
+`--verify`, results are cached when `BRIL_CACHE` is set (see
+`util.cached`).
+"""
+
+import sys
+import time
+from collections import namedtuple
+
+from analyses import AnalysisManager
+import adce
+import from_ssa
+import gvn
+import ivs
+import licm
+import lvn
+import sccp
+import tdce
+import to_ssa
+from util import cached, jobs_arg, modify_funcs
+
+# A pass: `run(func, am, opts)` changes a function in place, given the
+# `AnalysisManager` and the list of options, and returns the set of
+# analyses it preserves. `options` are the options it accepts. `ssa` is
+# True if the pass puts functions in SSA form, False if it takes them out
+# of SSA form, and None if it leaves that alone.
+Pass = namedtuple('Pass', ['run', 'options', 'ssa'])
+
+
+class VerifyError(Exception):
+    """A function failed `verify_func` while running a pipeline.
+    """
+
+
+def _to_ssa(func, am, opts):
+    to_ssa.func_to_ssa(func, opts[-1] if opts else 'minimal', None, am)
+    return to_ssa.PRESERVES
+
+
+def _from_ssa(func, am, opts):
+    if 'coalesce' in opts:
+        from_ssa.func_from_ssa_coalesce(func)
+        return frozenset()
+    from_ssa.func_from_ssa(func, am)
+    return from_ssa.PRESERVES
+
+
+def _lvn(func, am, opts):
+    lvn.lvn_func(func, 'p' in opts, 'c' in opts, 'f' in opts)
+    return lvn.PRESERVES
+
+
+def _gvn(func, am, opts):
+    gvn.gvn_func(func, 'p' in opts, 'c' in opts, 'f' in opts, am)
+    return gvn.PRESERVES
+
+
+def _licm(func, am, opts):
+    licm.licm_func(func)
+    return licm.PRESERVES
+
+
+def _ivs(func, am, opts):
+    ivs.ivs_func(func)
+    return ivs.PRESERVES
+
+
+def _sccp(func, am, opts):
+    sccp.sccp_func(func)
+    return sccp.PRESERVES
+
+
+def _adce(func, am, opts):
+    adce.adce_func(func, 'control' in opts)
+    return adce.PRESERVES
+
+
+def _tdce(mode):
+    def run(func, am, opts):
+        tdce.MODES[mode](func)
+        return tdce.PRESERVES
+    return run
+
+
+PASSES = {
+    'to_ssa': Pass(_to_ssa, to_ssa.MODES, True),
+    'from_ssa': Pass(_from_ssa, ('coalesce',), False),
+    'lvn': Pass(_lvn, ('p', 'c', 'f'), None),
+    'gvn': Pass(_gvn, ('p', 'c', 'f'), None),
+    'sccp': Pass(_sccp, (), None),
+    'licm': Pass(_licm, (), None),
+    'ivs': Pass(_ivs, (), None),
+    'adce': Pass(_adce, ('control',), None),
+}
+for mode in tdce.MODES:
+    PASSES[mode] = Pass(_tdce(mode), (), None)
+
+
+def parse_pipeline(spec):
+    """Parse a comma-separated list of passes into a list of `(name,
+    options)` pairs. Raise a ValueError for an unknown pass or option.
+    """
+    pipeline = []
+    for item in spec.split(','):
+        name, *opts = item.split(':')
+        if name not in PASSES:
+            raise ValueError('unknown pass {}'.format(name))
+        for opt in opts:
+            if opt not in PASSES[name].options:
+                raise ValueError('unknown option {} for {}'.format(opt, name))
+        pipeline.append((name, opts))
+    return pipeline
+
+
+def verify_func(func, ssa=False):
+    """Check a function for mistakes that a pass can make and return a
+    list of messages describing them.
+
+    Every label must be unique and every label operand must name one.
+    Every variable argument must be assigned somewhere (or be the
+    `__undefined` placeholder that `to_ssa` uses), with one type for
+    each variable. Jumps, branches, and phi-nodes must have the right
+    number of operands. If `ssa` is true, every variable must be assigned
+    only once.
+    """
+    errors = []
+    labels = set()
+    for instr in func['instrs']:
+        if 'label' in instr:
+            if instr['label'] in labels:
+                errors.append('duplicate label {}'.format(instr['label']))
+            labels.add(instr['label'])
+
+    types = {a['name']: a['type'] for a in func.get('args', [])}
+    for instr in func['instrs']:
+        if 'dest' in instr:
+            dest = instr['dest']
+            if ssa and dest in types:
+                errors.append('{} is assigned more than once'.format(dest))
+            elif types.get(dest, instr.get('type')) != instr.get('type'):
+                errors.append('{} has more than one type'.format(dest))
+            types[dest] = instr.get('type')
+
+    for instr in func['instrs']:
+        if 'label' in instr:
+            continue
+        op = instr.get('op')
+        if op is None:
+            errors.append('instruction without an op: {}'.format(instr))
+            continue
+        args = instr.get('args', [])
+        for label in instr.get('labels', []):
+            if label not in labels:
+                errors.append('{} to undefined label {}'.format(op, label))
+        for arg in args:
+            if arg not in types and arg != '__undefined':
+                errors.append('{} of undefined variable {}'.format(op, arg))
+        if op == 'jmp' and len(instr.get('labels', [])) != 1 or \
+           op == 'br' and (len(instr.get('labels', [])) != 2 or
+                           len(args) != 1) or \
+           op == 'phi' and len(instr.get('labels', [])) != len(args):
+            errors.append('wrong number of operands for {}'.format(op))
+
+    return ['{}: {}'.format(func['name'], e) for e in errors]
+
+
+def run_passes(func, pipeline, am, times=None, verify=False):
+    """Run a parsed pipeline on a function. If `times` is a list, add the
+    seconds spent in each pass to its entries. If `verify` is true, check
+    the function with `verify_func` before and after each pass and raise
+    a `VerifyError` if it finds anything wrong.
+    """
+    ssa = False
+    if verify:
+        _check(func, ssa, 'before the first pass')
+    for i, (name, opts) in enumerate(pipeline):
+        p = PASSES[name]
+        start = time.perf_counter()
+        am.invalidate(func, p.run(func, am, opts))
+        if times is not None:
+            times[i] += time.perf_counter() - start
+        if p.ssa is not None:
+            ssa = p.ssa
+        if verify:
+            _check(func, ssa, 'after {}'.format(':'.join([name] + opts)))
+    am.forget(func)
+
+
+def _check(func, ssa, where):
+    errors = verify_func(func, ssa)
+    if errors:
+        raise VerifyError('\n'.join(
+            '{}: {}'.format(where, e) for e in errors
+        ))
+
+
+if __name__ == '__main__':
+    spec = ''
+    for arg in sys.argv[1:]:
+        if arg.startswith('--passes='):
+            spec = arg[len('--passes='):]
+    pipeline = parse_pipeline(spec) if spec else []
+    times = [0.0] * len(pipeline) if '--time' in sys.argv[1:] else None
+    verify = '--verify' in sys.argv[1:]
+
+    am = AnalysisManager()
+
+    def modify(func):
+        run_passes(func, pipeline, am, times, verify)
+    if times is None and not verify:
+        modify = cached(modify, ['opt', pipeline])
+    # The workers' times would be lost, so time the passes in one process.
+    jobs = jobs_arg(sys.argv[1:]) if times is None else 1
+    try:
+        modify_funcs(modify, jobs=jobs)
+    except VerifyError as e:
+        sys.exit(str(e))
+    if times is not None:
+        for (name, opts), t in zip(pipeline, times):
+            print('{}: {:.3f}s'.format(':'.join([name] + opts), t),
+                  file=sys.stderr)
@@ -0,0 +1,222 @@
+"""Sparse conditional constant propagation for Bril functions in SSA form
+(as produced by `to_ssa.py`).
+
+This is the algorithm from Wegman and Zadeck's "Constant Propagation with
+Conditional Branches." It finds the variables that have the same
+constant value every time they are assigned, assuming only control-flow
+edges that can actually be taken, and then rewrites the function:
+instructions that compute constants become `const` instructions,
+branches on constants become jumps, and unreachable blocks are deleted.
+Follow it with `tdce.py` to remove the definitions that are no longer
+used.
+"""
+
+from collections import OrderedDict, defaultdict
+import operator
+import sys
+
+from cfg import CFG, reassemble
+from util import cached, jobs_arg, modify_funcs
+
+
+class _Mark:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+# The lattice of values: TOP means no assignment has been seen yet,
+# BOTTOM means the variable can have more than one value (or one we
+# cannot know), and anything else is the variable's constant value.
+TOP = _Mark('TOP')
+BOTTOM = _Mark('BOTTOM')
+
+
+def _wrap(n):
+    # Integers wrap around at 64 bits.
+    return (n + 2**63) % 2**64 - 2**63
+
+
+def _div(a, b):
+    # Integer division rounds toward zero.
+    q = abs(a) // abs(b)
+    return _wrap(q if (a < 0) == (b < 0) else -q)
+
+
+FOLDABLE_OPS = {
+    'add': lambda a, b: _wrap(a + b),
+    'sub': lambda a, b: _wrap(a - b),
+    'mul': lambda a, b: _wrap(a * b),
+    'div': _div,
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'gt': operator.gt,
+    'le': operator.le,
+    'ge': operator.ge,
+    'not': operator.not_,
+    'and': lambda a, b: a and b,
+    'or': lambda a, b: a or b,
+}
+
+
+def _same(a, b):
+    """Check whether two lattice values are the same. (Constants must
+    have the same type, and floats the same sign, to be the same.)
+    """
+    return a is b or (a is not TOP and a is not BOTTOM and
+                      b is not TOP and b is not BOTTOM and
+                      type(a) is type(b) and repr(a) == repr(b))
+
+
+def meet(a, b):
+    if a is TOP:
+        return b
+    if b is TOP or _same(a, b):
+        return a
+    return BOTTOM
+
+
+def evaluate(instr, value):
+    """Get the lattice value that an instruction assigns, given a
+    function that gets the lattice value of a variable.
+    """
+    op = instr['op']
+    if op == 'const':
+        return instr['value']
+    args = [value(a) for a in instr.get('args', [])]
+    if op == 'id':
+        return args[0]
+
+    # `and` with a false argument and `or` with a true one do not depend
+    # on the other argument.
+    if op in ('and', 'or'):
+        short = op == 'or'
+        for a in args:
+            if a is not TOP and a is not BOTTOM and a == short:
+                return short
+
+    if op not in FOLDABLE_OPS or BOTTOM in args:
+        return BOTTOM
+    if TOP in args:
+        return TOP
+    try:
+        return FOLDABLE_OPS[op](*args)
+    except ZeroDivisionError:
+        return BOTTOM
+
+
+def sccp_func(func):
+    """Propagate constants through a function in SSA form and rewrite it
+    in place.
+    """
+    g = CFG(func['instrs'])
+    if not g.blocks:
+        return
+
+    # Function arguments can be anything. Variables that are used but
+    # never assigned are also unknown.
+    values = {a['name']: BOTTOM for a in func.get('args', [])}
+    defined = set(values)
+    uses = defaultdict(list)
+    for b, block in enumerate(g.blocks):
+        for instr in block:
+            for arg in instr.get('args', []):
+                uses[arg].append((b, instr))
+            if 'dest' in instr:
+                defined.add(instr['dest'])
+
+    def value(var):
+        return values.get(var, TOP if var in defined else BOTTOM)
+
+    edges = set()
+    reached = [False] * len(g.blocks)
+    flow = [(-1, 0)]  # Control-flow edges to mark executable.
+    ssa = []  # Instructions whose arguments' values changed.
+
+    def assign(var, new):
+        if not _same(value(var), new):
+            values[var] = new
+            ssa.extend(uses[var])
+
+    def visit(b, instr):
+        op = instr.get('op')
+        if op == 'phi':
+            # Only the arguments from executable edges count.
+            new = TOP
+            for label, arg in zip(instr['labels'], instr['args']):
+                if (g.index.get(label), b) in edges and arg != '__undefined':
+                    new = meet(new, value(arg))
+            assign(instr['dest'], new)
+        elif op == 'br':
+            cond = value(instr['args'][0])
+            if cond is BOTTOM:
+                targets = instr['labels']
+            elif cond is TOP:
+                targets = []
+            else:
+                targets = [instr['labels'][0 if cond else 1]]
+            flow.extend((b, g.index[label]) for label in targets)
+        elif 'labels' in instr:
+            # A jump, or a `guard` (whose target must be kept too).
+            flow.extend((b, g.index[label]) for label in instr['labels'])
+        elif 'dest' in instr:
+            assign(instr['dest'], evaluate(instr, value))
+
+    while flow or ssa:
+        while flow:
+            edge = flow.pop()
+            if edge in edges:
+                continue
+            edges.add(edge)
+            b = edge[1]
+            if reached[b]:
+                # Only the phi-nodes can tell the new edge apart.
+                for instr in g.blocks[b]:
+                    if instr.get('op') == 'phi':
+                        visit(b, instr)
+            else:
+                reached[b] = True
+                for instr in g.blocks[b]:
+                    visit(b, instr)
+        while ssa:
+            b, instr = ssa.pop()
+            if reached[b]:
+                visit(b, instr)
+
+    # Rewrite the reachable blocks.
+    blocks = OrderedDict()
+    for b, name in enumerate(g.names):
+        if not reached[b]:
+            continue
+        new_block = []
+        for instr in g.blocks[b]:
+            op = instr.get('op')
+            if op == 'phi':
+                pairs = [(label, arg) for label, arg
+                         in zip(instr['labels'], instr['args'])
+                         if (g.index.get(label), b) in edges]
+                instr['labels'] = [label for label, _ in pairs]
+                instr['args'] = [arg for _, arg in pairs]
+            if 'dest' in instr and op != 'const':
+                v = value(instr['dest'])
+                if v is not TOP and v is not BOTTOM:
+                    instr = {'op': 'const', 'dest': instr['dest'],
+                             'type': instr['type'], 'value': v}
+            elif op == 'br':
+                cond = value(instr['args'][0])
+                if cond is not TOP and cond is not BOTTOM:
+                    instr = {'op': 'jmp',
+                             'labels': [instr['labels'][0 if cond else 1]]}
+            new_block.append(instr)
+        blocks[name] = new_block
+    func['instrs'] = reassemble(blocks)
+
+
+# `sccp_func` can delete blocks, so it keeps no analyses valid.
+PRESERVES = frozenset()
+
+
+if __name__ == '__main__':
+    modify_funcs(cached(sccp_func, ['sccp']), jobs=jobs_arg(sys.argv[1:]))
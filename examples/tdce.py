@@ -3,9 +3,8 @@ local optimization.
 """
 
 import sys
-import json
 from form_blocks import form_blocks
-from util import flatten
+from util import cached, flatten, jobs_arg, modify_funcs
 
 
 def trivial_dce_pass(func):
@@ -112,6 +111,10 @@ def trivial_dce_plus(func):
         pass
 
 
+# The analyses that these passes keep valid. Deleting instructions can
+# remove a whole unlabeled block, so that is none of them.
+PRESERVES = frozenset()
+
 MODES = {
     'tdce': trivial_dce,
     'tdcep': trivial_dce_pass,
@@ -121,16 +124,15 @@ MODES = {
 
 
 def localopt():
-    if len(sys.argv) > 1:
-        modify_func = MODES[sys.argv[1]]
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        mode = sys.argv[1]
     else:
-        modify_func = trivial_dce
+        mode = 'tdce'
 
-    # Apply the change to all the functions in the input program.
-    bril = json.load(sys.stdin)
-    for func in bril['functions']:
-        modify_func(func)
-    json.dump(bril, sys.stdout, indent=2, sort_keys=True)
+    # Apply the change to all the functions in the input program, one
+    # function at a time.
+    modify_funcs(cached(MODES[mode], ['tdce', mode]),
+                 jobs=jobs_arg(sys.argv[1:]))
 
 
 if __name__ == '__main__':
@@ -1,10 +1,12 @@
-import json
 import sys
 from collections import defaultdict
 
-from cfg import block_map, successors, add_terminators, add_entry, reassemble
-from form_blocks import form_blocks
-from dom import get_dom, dom_fronts, dom_tree
+from analyses import AnalysisManager, CFG_SHAPE
+from cfg import reassemble
+from dom import Dominators
+from df import df_worklist, use, BIT_ANALYSES, IR_BIT_ANALYSES, use_bits
+import ir
+from util import cached, jobs_arg, modify_funcs
 
 
 def def_blocks(blocks):
@@ -18,76 +20,128 @@ def def_blocks(blocks):
     return dict(out)
 
 
-def get_phis(blocks, df, defs):
+def global_names(blocks):
+    """Get the variables that are read in some block before they are
+    written in that block. Only these can need phi-nodes.
+    """
+    out = set()
+    for block in blocks.values():
+        out.update(use(block))
+    return out
+
+
+def live_in(blocks, liveness=None):
+    """Get a predicate that checks whether a variable is live on entry
+    to a block. Pass the blocks' `analyses.Liveness` if it is known.
+    """
+    if liveness is None:
+        analysis, var_bits = BIT_ANALYSES['live'](blocks)
+        live, _ = df_worklist(blocks, analysis)
+    else:
+        live, _, var_bits = liveness
+
+    def is_live(v, block):
+        return v in var_bits.index and bool(
+            live[block] >> var_bits.index[v] & 1
+        )
+    return is_live
+
+
+def get_phis(blocks, df, defs, needs_phi=lambda v, block: True):
     """Find where to insert phi-nodes in the blocks.
 
     Produce a map from block names to variable names that need phi-nodes
     in those blocks. (We will need to generate names and actually insert
-    instructions later.)
+    instructions later.) The `needs_phi` predicate can veto phi-nodes
+    for a variable in a given block, which prunes the phi-nodes that
+    placement on the iterated dominance frontier would otherwise insert.
     """
     phis = {b: set() for b in blocks}
     for v, v_defs in defs.items():
         v_defs_list = list(v_defs)
+        v_defs = set(v_defs)
         for d in v_defs_list:
             for block in df[d]:
                 # Add a phi-node...
-                if v not in phis[block]:
+                if v not in phis[block] and needs_phi(v, block):
                     # ..unless we already did.
                     phis[block].add(v)
-                    if block not in v_defs_list:
+                    if block not in v_defs:
+                        v_defs.add(block)
                         v_defs_list.append(block)
     return phis
 
 
+def count_phis(stats, phis, minimal):
+    """Add the number of phi-nodes in the placement `phis` to `stats`
+    (see `func_to_ssa`), where `minimal` is the placement for minimal SSA.
+    """
+    count = sum(len(ps) for ps in phis.values())
+    minimal = sum(len(ps) for ps in minimal.values())
+    stats['phis'] = stats.get('phis', 0) + count
+    stats['phis_avoided'] = stats.get('phis_avoided', 0) + minimal - count
+
+
 def ssa_rename(blocks, phis, succ, domtree, args):
+    # The current name of each variable is at the end of its stack.
     stack = defaultdict(list, {v: [v] for v in args})
     phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
     phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
     counters = defaultdict(int)
 
-    def _push_fresh(var):
+    def _push_fresh(var, pushed):
         fresh = '{}.{}'.format(var, counters[var])
         counters[var] += 1
-        stack[var].insert(0, fresh)
+        stack[var].append(fresh)
+        pushed.append(var)
         return fresh
 
     def _rename(block):
-        # Save stacks.
-        old_stack = {k: list(v) for k, v in stack.items()}
+        """Rename the variables in a block and the phi-node arguments in
+        its successors. Return the list of variables that got new names
+        pushed onto their stacks.
+        """
+        pushed = []
 
         # Rename phi-node destinations.
         for p in phis[block]:
-            phi_dests[block][p] = _push_fresh(p)
+            phi_dests[block][p] = _push_fresh(p, pushed)
 
         for instr in blocks[block]:
             # Rename arguments in normal instructions.
             if 'args' in instr:
-                new_args = [stack[arg][0] for arg in instr['args']]
+                new_args = [stack[arg][-1] for arg in instr['args']]
                 instr['args'] = new_args
 
             # Rename destinations.
             if 'dest' in instr:
-                instr['dest'] = _push_fresh(instr['dest'])
+                instr['dest'] = _push_fresh(instr['dest'], pushed)
 
         # Rename phi-node arguments (in successors).
         for s in succ[block]:
             for p in phis[s]:
                 if stack[p]:
-                    phi_args[s][p].append((block, stack[p][0]))
+                    phi_args[s][p].append((block, stack[p][-1]))
                 else:
                     # The variable is not defined on this path
                     phi_args[s][p].append((block, "__undefined"))
 
-        # Recursive calls.
-        for b in sorted(domtree[block]):
-            _rename(b)
-
-        # Restore stacks.
-        stack.clear()
-        stack.update(old_stack)
+        return pushed
 
-    entry = list(blocks.keys())[0]
-    _rename(entry)
+    # Walk the dominator tree in preorder with an explicit stack, so deep
+    # trees don't run into the recursion limit. An entry is either a
+    # block to rename or, once a block's subtree is done, the list of
+    # variables whose new names must be popped.
+    todo = [(list(blocks.keys())[0], None)]
+    while todo:
+        block, pushed = todo.pop()
+        if block is None:
+            for var in pushed:
+                stack[var].pop()
+        else:
+            todo.append((None, _rename(block)))
+            todo.extend((b, None) for b in sorted(domtree[block],
+                                                  reverse=True))
 
     return phi_args, phi_dests
 
@@ -116,31 +170,201 @@ def get_types(func):
     return types
 
 
-def func_to_ssa(func):
-    blocks = block_map(form_blocks(func['instrs']))
-    add_entry(blocks)
-    add_terminators(blocks)
-    succ = {name: successors(block[-1]) for name, block in blocks.items()}
-    dom = get_dom(succ, list(blocks.keys())[0])
+def func_to_ssa(func, mode='minimal', stats=None, am=None):
+    """Convert a function to SSA form in place.
 
-    df = dom_fronts(dom, succ)
+    `mode` is one of `MODES`. If `stats` is a dict, add the number of
+    phi-nodes inserted (`'phis'`) and the number that pruning avoided
+    compared to minimal SSA (`'phis_avoided'`) to its counts. The CFG,
+    dominators, and liveness come from the `AnalysisManager` `am`, if
+    given; the `PRESERVES` analyses stay valid.
+    """
+    if am is None:
+        am = AnalysisManager()
+    blocks = am.get(func, 'cfg')
+    _, succ = am.get(func, 'edges')
+    entry = next(iter(blocks))
+    doms = am.get(func, 'dominators')
+
+    df = am.get(func, 'frontiers')
     defs = def_blocks(blocks)
     types = get_types(func)
     arg_names = {a['name'] for a in func['args']} if 'args' in func else set()
 
-    phis = get_phis(blocks, df, defs)
-    phi_args, phi_dests = ssa_rename(blocks, phis, succ, dom_tree(dom),
-                                     arg_names)
+    if mode == 'pruned':
+        phis = get_phis(blocks, df, defs,
+                        live_in(blocks, am.get(func, 'live')))
+    elif mode == 'semi-pruned':
+        names = global_names(blocks)
+        phis = get_phis(blocks, df, defs, lambda v, block: v in names)
+    else:
+        phis = get_phis(blocks, df, defs)
+
+    if stats is not None:
+        minimal = phis if mode == 'minimal' else get_phis(blocks, df, defs)
+        count_phis(stats, phis, minimal)
+
+    # Blocks that are unreachable in the CFG (such as the targets of
+    # `guard`) are not in the dominator tree. Rename them as if the entry
+    # immediately dominated them.
+    domtree = dict(doms.tree())
+    domtree[entry] = domtree[entry] | {b for b in blocks
+                                       if b not in doms.index}
+
+    phi_args, phi_dests = ssa_rename(blocks, phis, succ, domtree, arg_names)
     insert_phis(blocks, phi_args, phi_dests, types)
 
     func['instrs'] = reassemble(blocks)
 
 
-def to_ssa(bril):
+def ssa_rename_ir(func, blocks, phis, succ, domtree):
+    """Like `ssa_rename`, for blocks of `ir.Instr` in `func`. New
+    variable names are interned in `func`.
+    """
+    var_id = func.vars.ids.__getitem__
+    names = func.vars.names
+    label_names = func.labels.names
+    stack = defaultdict(list)
+    if func.args is not None:
+        for a in func.args:
+            stack[a.var] = [a.var]
+    phi_args = {b: {p: [] for p in phis[b]} for b in blocks}
+    phi_dests = {b: {p: None for p in phis[b]} for b in blocks}
+    counters = defaultdict(int)
+
+    def _push_fresh(var, pushed):
+        fresh = var_id('{}.{}'.format(names[var], counters[var]))
+        counters[var] += 1
+        stack[var].append(fresh)
+        pushed.append(var)
+        return fresh
+
+    def _rename(block):
+        pushed = []
+        for p in phis[block]:
+            phi_dests[block][p] = _push_fresh(p, pushed)
+
+        for instr in blocks[block]:
+            if instr.args is not None:
+                instr.args = [stack[arg][-1] for arg in instr.args]
+            if instr.dest is not None:
+                instr.dest = _push_fresh(instr.dest, pushed)
+
+        for s in succ[block]:
+            for p in phis[s]:
+                if stack[p]:
+                    phi_args[s][p].append((block, stack[p][-1]))
+                else:
+                    phi_args[s][p].append((block, var_id('__undefined')))
+
+        return pushed
+
+    todo = [(next(iter(blocks)), None)]
+    while todo:
+        block, pushed = todo.pop()
+        if block is None:
+            for var in pushed:
+                stack[var].pop()
+        else:
+            todo.append((None, _rename(block)))
+            todo.extend((b, None) for b in sorted(
+                domtree[block], key=label_names.__getitem__, reverse=True,
+            ))
+
+    return phi_args, phi_dests
+
+
+def func_to_ssa_ir(func, mode='minimal', stats=None):
+    """Like `func_to_ssa`, for an `ir.Function`.
+    """
+    blocks = ir.block_map(func, ir.form_blocks(func.instrs))
+    ir.add_entry(func, blocks)
+    ir.add_terminators(blocks)
+    succ = {name: ir.successors(block[-1]) for name, block in blocks.items()}
+    entry = next(iter(blocks))
+    doms = Dominators(succ, entry)
+
+    df = doms.fronts()
+    defs = defaultdict(set)
+    types = {a.var: a.type for a in func.args} if func.args else {}
+    for name, block in blocks.items():
+        for instr in block:
+            if instr.dest is not None:
+                defs[instr.dest].add(name)
+    for instr in func.instrs:
+        if instr.dest is not None:
+            types[instr.dest] = instr.type
+
+    if mode == 'pruned':
+        live, _ = df_worklist(blocks, IR_BIT_ANALYSES['live'](blocks),
+                              edges=ir.edges)
+        phis = get_phis(blocks, df, defs,
+                        lambda v, block: live[block] >> v & 1)
+    elif mode == 'semi-pruned':
+        used = 0
+        for block in blocks.values():
+            used |= use_bits(block)
+        phis = get_phis(blocks, df, defs, lambda v, block: used >> v & 1)
+    else:
+        phis = get_phis(blocks, df, defs)
+
+    if stats is not None:
+        minimal = phis if mode == 'minimal' else get_phis(blocks, df, defs)
+        count_phis(stats, phis, minimal)
+
+    domtree = dict(doms.tree())
+    domtree[entry] = domtree[entry] | {b for b in blocks
+                                       if b not in doms.index}
+
+    phi_args, phi_dests = ssa_rename_ir(func, blocks, phis, succ, domtree)
+
+    names = func.vars.names
+    for block, instrs in blocks.items():
+        for dest, pairs in sorted(phi_args[block].items(),
+                                  key=lambda item: names[item[0]]):
+            instrs.insert(0, ir.Instr(
+                ir.PHI, phi_dests[block][dest], types[dest],
+                args=[p[1] for p in pairs], labels=[p[0] for p in pairs],
+            ))
+
+    func.instrs = ir.reassemble(blocks)
+
+
+# The analyses that `func_to_ssa` keeps valid. Phi-nodes go into the
+# blocks of the `'cfg'` result, and the function is reassembled from it.
+PRESERVES = CFG_SHAPE | {'cfg'}
+
+# Phi-node placement strategies: minimal SSA places phi-nodes on the
+# whole iterated dominance frontier; semi-pruned SSA only does so for
+# variables that are live across blocks; and pruned SSA only where the
+# variable is live on entry to the block.
+MODES = ('minimal', 'semi-pruned', 'pruned')
+
+
+def to_ssa(bril, mode='minimal', stats=None):
     for func in bril['functions']:
-        func_to_ssa(func)
+        func_to_ssa(func, mode, stats)
     return bril
 
 
 if __name__ == '__main__':
-    print(json.dumps(to_ssa(json.load(sys.stdin)), indent=2, sort_keys=True))
+    mode = 'minimal'
+    for m in MODES:
+        if '--{}'.format(m) in sys.argv[1:]:
+            mode = m
+    stats = {} if '--stats' in sys.argv[1:] else None
+    use_ir = '--ir' in sys.argv[1:]
+    if use_ir:
+        modify = ir.on_json(lambda func: func_to_ssa_ir(func, mode, stats))
+    else:
+        def modify(func):
+            func_to_ssa(func, mode, stats)
+    if stats is None:
+        modify_funcs(cached(modify, ['to_ssa', mode, use_ir]),
+                     jobs=jobs_arg(sys.argv[1:]))
+    else:
+        # Stats need every function converted in this process.
+        modify_funcs(modify)
+    if stats is not None:
+        for key, value in sorted(stats.items()):
+            print('{}: {}'.format(key, value), file=sys.stderr)
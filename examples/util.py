@@ -1,4 +1,9 @@
+import glob
 import itertools
+import json
+import multiprocessing
+import os
+import sys
 
 
 def flatten(ll):
@@ -16,3 +21,220 @@ def fresh(seed, names):
         if name not in names:
             return name
         i += 1
+
+
+class Fresh:
+    """Generate new names like `fresh`, adding each one to the set
+    `names`.
+
+    The next number to try is remembered for each seed, so generating
+    many names with the same seed takes linear time instead of quadratic.
+    As long as `names` only grows, the names are the same ones that
+    calling `fresh` and adding its result would give.
+    """
+
+    def __init__(self, names=None):
+        self.names = set() if names is None else names
+        self._next = {}
+
+    def __call__(self, seed):
+        i = self._next.get(seed, 1)
+        while seed + str(i) in self.names:
+            i += 1
+        self._next[seed] = i + 1
+        name = seed + str(i)
+        self.names.add(name)
+        return name
+
+
+# The format of the last program read by `load_bril`, so `dump_bril` can
+# answer in kind.
+_binary = False
+
+
+def load_bril(f=None):
+    """Read a Bril program from a stream (standard input by default) in
+    either the JSON or the binary format (see `bril-bin`).
+    """
+    global _binary
+    f = f or sys.stdin
+    buf = getattr(f, 'buffer', f)
+    import brilbin
+    _binary = hasattr(buf, 'peek') and brilbin.is_binary(buf)
+    if _binary:
+        return brilbin.load(buf)
+    return json.load(f)
+
+
+def dump_bril(bril, f=None):
+    """Write a Bril program to a stream (standard output by default) in
+    the format that `load_bril` last read.
+    """
+    f = f or sys.stdout
+    if _binary:
+        import brilbin
+        f.flush()
+        brilbin.dump(bril, getattr(f, 'buffer', f))
+    else:
+        if not isinstance(bril['functions'], list):
+            bril = dict(bril, functions=list(bril['functions']))
+        json.dump(bril, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# Streaming programs one function at a time. This way, a pass that only
+# looks at one function at a time needs memory for the largest function
+# instead of the whole program.
+
+def load_funcs(f=None, other=None, chunk_size=1 << 16):
+    """Read a Bril program from a stream (standard input by default) in
+    either format, and get an iterator over its functions that reads each
+    one only when it is needed.
+
+    The other top-level data (such as `structs`) is added to the `other`
+    dict, if given, as it is read. In JSON it may come after the
+    functions, so it is only complete once the iterator is exhausted.
+    """
+    global _binary
+    f = f or sys.stdin
+    buf = getattr(f, 'buffer', f)
+    import brilbin
+    _binary = hasattr(buf, 'peek') and brilbin.is_binary(buf)
+    other = {} if other is None else other
+    if _binary:
+        return brilbin.load_funcs(buf, other)
+    return brilbin.load_json_funcs(f, other, chunk_size)
+
+
+def _json_text(value, indent):
+    """Format a JSON value like `json.dump` does with `indent=2` and
+    `sort_keys=True`, as if nested at the given indentation.
+    """
+    text = json.dumps(value, indent=2, sort_keys=True)
+    return text.replace('\n', '\n' + indent)
+
+
+def dump_funcs(funcs, other, f=None):
+    """Write a Bril program to a stream (standard output by default) in
+    the format that `load_bril` or `load_funcs` last read, writing each
+    function as soon as the `funcs` iterable produces it.
+
+    `other` holds the rest of the top-level data; it is read both before
+    the first function and after the last one, so it can be filled in by
+    `load_funcs` as the functions go by. For JSON input with sorted keys
+    (as every tool here writes), the output is the same as `dump_bril`'s.
+    """
+    f = f or sys.stdout
+    if _binary:
+        import brilbin
+        f.flush()
+        brilbin.dump_funcs(funcs, other, getattr(f, 'buffer', f))
+        return
+
+    f.write('{\n')
+    done = set()
+    for key in sorted(k for k in other if k < 'functions'):
+        text = _json_text(other[key], '  ')
+        f.write('  {}: {},\n'.format(json.dumps(key), text))
+        done.add(key)
+    f.write('  "functions": [')
+    sep = '\n'
+    for func in funcs:
+        # Functions formatted by `_modify_one` come as text.
+        if not isinstance(func, str):
+            func = _json_text(func, '    ')
+        f.write(sep + '    ' + func)
+        sep = ',\n'
+    f.write(']' if sep == '\n' else '\n  ]')
+    for key in sorted(k for k in other if k not in done):
+        text = _json_text(other[key], '  ')
+        f.write(',\n  {}: {}'.format(json.dumps(key), text))
+    f.write('\n}\n')
+
+
+def modify_funcs(modify, f_in=None, f_out=None, jobs=1):
+    """Stream a program from `f_in` to `f_out` (standard input and output
+    by default), calling `modify` on each function to change it in place
+    before it is written.
+
+    With `jobs` > 1, the functions are modified in a pool of that many
+    worker processes and written in their original order. The workers are
+    forked, so `modify` can be any function, but anything it changes
+    besides the function it is given (such as a stats dict) is lost.
+    Without `fork` (as on Windows), this falls back to one process.
+    """
+    other = {}
+    funcs = load_funcs(f_in, other)
+
+    if jobs > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        dump_funcs(_modify_parallel(modify, funcs, jobs), other, f_out)
+        return
+
+    def modified():
+        for func in funcs:
+            modify(func)
+            yield func
+    dump_funcs(modified(), other, f_out)
+
+
+# The `modify` function for the worker processes of `_modify_parallel`,
+# which they inherit when they are forked.
+_worker_modify = None
+
+
+def _modify_one(func):
+    _worker_modify(func)
+    # Format JSON in the worker, too, so the parent only has to write it.
+    return func if _binary else _json_text(func, '    ')
+
+
+def _modify_parallel(modify, funcs, jobs):
+    """Modify functions in a pool of worker processes, producing them in
+    their original order.
+    """
+    global _worker_modify
+    _worker_modify = modify
+    with multiprocessing.get_context('fork').Pool(jobs) as pool:
+        yield from pool.imap(_modify_one, funcs, chunksize=16)
+
+
+def jobs_arg(args):
+    """Get the number of worker processes that a list of command-line
+    arguments asks for with `-j N` or `-jN`: 1 by default, or the number
+    of CPUs for a bare `-j`.
+    """
+    jobs = 1
+    for i, arg in enumerate(args):
+        if arg.startswith('-j'):
+            n = arg[2:] or (args[i + 1] if i + 1 < len(args) else '')
+            jobs = int(n) if n.isdigit() else multiprocessing.cpu_count()
+    return jobs
+
+
+def cached(modify, tag):
+    """Make a version of `modify` (which changes a function in place)
+    that uses the function cache from `bril-cache` when the `BRIL_CACHE`
+    environment variable is set.
+
+    `tag` is a JSON value that describes what `modify` does, such as the
+    pass name and its options. The cache key also covers the function
+    and the source of these examples, so changing any of those misses
+    the cache.
+    """
+    if not os.environ.get('BRIL_CACHE'):
+        return modify
+    import brilcache
+    cache = brilcache.from_env()
+    here = os.path.dirname(os.path.abspath(__file__))
+    version = brilcache.source_version(*glob.glob(os.path.join(here, '*.py')))
+
+    def modify_cached(func):
+        key = brilcache.key(func, tag, version)
+        data = cache.get(key)
+        if data is None:
+            modify(func)
+            cache.put(key, json.dumps(func).encode())
+        else:
+            func.clear()
+            func.update(json.loads(data))
+    return modify_cached
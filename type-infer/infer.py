@@ -146,8 +146,18 @@ def typecheck(original_bril, typed_bril):
         typecheck_func(original_bril["functions"][i], typed_bril["functions"][i])
 
 if __name__ == '__main__':
-    bril = json.load(sys.stdin)
+    # Also accept the binary format from bril-bin, and answer in the same
+    # format.
+    import brilbin
+    binary = brilbin.is_binary(sys.stdin.buffer)
+    if binary:
+        bril = brilbin.load(sys.stdin.buffer)
+    else:
+        bril = json.load(sys.stdin)
     typed_bril = infer_types(bril)
     if '-t' in sys.argv:
         typecheck(bril, typed_bril)
-    json.dump(typed_bril, sys.stdout, indent=2, sort_keys=True)
+    if binary:
+        brilbin.dump(typed_bril, sys.stdout.buffer)
+    else:
+        json.dump(typed_bril, sys.stdout, indent=2, sort_keys=True)